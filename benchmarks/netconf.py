@@ -0,0 +1,159 @@
+import argparse
+import logging
+import statistics
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.simulator import Simulator
+from src.controllers.metrics import RpcMetrics
+from src.controllers.netconf import Device, DISCOVERY_WORKERS
+
+# Benchmark of Device discovery and configuration against simulated routers (see benchmarks/simulator.py).
+# Routers form a ring (GigabitEthernet2 to the next router's GigabitEthernet3), plus chords across the ring on GigabitEthernet4.
+# Run from the repository root: python -m benchmarks.netconf --routers 200 --latency 0.005
+
+# Build simulator and ring topology. Returns (simulator, links), links are [(a, interface_a, b, interface_b), ...]
+def build_simulator(args):
+    simulator = Simulator(base_port=args.base_port)
+
+    for i in range(args.routers):
+        simulator.add_router(f'R{i}', latency=args.latency, jitter=args.jitter, failure_rate=args.failure_rate, drop_rate=args.drop_rate, on_change=args.on_change)
+
+    links = [(f'R{i}', 'GigabitEthernet2', f'R{(i + 1) % args.routers}', 'GigabitEthernet3') for i in range(args.routers)]
+
+    # Chords across the ring, every router has at most one
+    for i in range(int(args.routers // 2 * args.chords)):
+        links.append((f'R{i}', 'GigabitEthernet4', f'R{i + args.routers // 2}', 'GigabitEthernet4'))
+
+    for link in links:
+        simulator.link(*link)
+
+    return (simulator, links)
+
+# Configurations of every router: link addresses, static routes, blocks and route-f
+# {hostname: [conf, ...]}
+def build_configurations(args, links, generation=0):
+    configurations = {f'R{i}': [] for i in range(args.routers)}
+
+    for (j, (a, interface_a, b, interface_b)) in enumerate(links):
+        network = f'10.{j // 64}.{(j % 64) * 4}'
+
+        configurations[a].append(f'address {interface_a} {network}.1/30')
+        configurations[b].append(f'address {interface_b} {network}.2/30')
+
+    for (hostname, confs) in configurations.items():
+        next_hop = next(conf.split(' ')[2].split('/')[0] for conf in confs if conf.split(' ')[1] == 'GigabitEthernet2')
+        (network, last) = next_hop.rsplit('.', 1)
+        next_hop = f'{network}.{3 - int(last)}' # Other address of the /30
+
+        for k in range(args.routes):
+            confs.append(f'route 172.16.{k}.1/24 GigabitEthernet2 {next_hop}')
+
+        # A new generation replaces a tenth of blocks and route-f, like a policy change
+        shift = generation * max(1, args.blocks // 10)
+
+        for k in range(shift, shift + args.blocks):
+            confs.append(f'block 192.168.{k % 256}.0/24 * 6 * {1000 + k}')
+
+        for k in range(shift, shift + args.blocks):
+            confs.append(f'route-f 192.168.{k % 256}.0/24 * 17 * {2000 + k} GigabitEthernet3')
+
+    return configurations
+
+# Run discover on every device, like NetconfController.discover_all without the deadline. Returns seconds
+def discovery_cycle(executor, devices):
+    start = time.perf_counter()
+
+    for future in [executor.submit(device.discover) for device in devices]:
+        future.result()
+
+    return time.perf_counter() - start
+
+# Push configurations to every device. Returns (seconds, operations, failed operations)
+def push(executor, devices, configurations, batch):
+    start = time.perf_counter()
+
+    futures = [executor.submit(device.configure_list, configurations[device.hostname], batch) for device in devices]
+    results = [result for future in futures for result in future.result()]
+
+    return (time.perf_counter() - start, len(results), sum(1 for (conf, deconf, success) in results if not success))
+
+def summary(times):
+    times = sorted(times)
+    p95 = times[min(len(times) - 1, int(len(times) * 0.95))]
+
+    return f'mean {statistics.mean(times):.3f}s, p50 {statistics.median(times):.3f}s, p95 {p95:.3f}s, max {times[-1]:.3f}s'
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark NETCONF discovery and configuration against simulated routers')
+    parser.add_argument('--routers', type=int, default=100)
+    parser.add_argument('--base-port', type=int, default=18300)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every reply')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Random seconds added to latency')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='Probability of an RPC error')
+    parser.add_argument('--drop-rate', type=float, default=0.0, help='Probability of a dropped session')
+    parser.add_argument('--chords', type=float, default=0.5, help='Fraction of router pairs linked across the ring')
+    parser.add_argument('--cycles', type=int, default=10, help='Discovery cycles after connecting')
+    parser.add_argument('--routes', type=int, default=5, help='Static routes per router')
+    parser.add_argument('--blocks', type=int, default=10, help='Blocks and route-f per router')
+    parser.add_argument('--workers', type=int, default=DISCOVERY_WORKERS)
+    parser.add_argument('--no-batch', action='store_true', help='Commit every operation on its own')
+    parser.add_argument('--notifications', action='store_true', help='Subscribe to notifications, and only poll routers that sent one')
+    parser.add_argument('--on-change', nargs='*', default=None, help='Xpaths routers accept YANG-push subscriptions for (default any, none for the NETCONF stream only)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    (simulator, links) = build_simulator(args)
+    simulator.start()
+
+    metrics = RpcMetrics()
+    devices = [Device('127.0.0.1', hostname, 'admin', 'admin', port=router.port, metrics=metrics, notifications=args.notifications) for (hostname, router) in simulator.routers.items()]
+
+    for device in devices:
+        device.logger.setLevel(logging.CRITICAL) # Injected failures would flood the output
+
+    executor = ThreadPoolExecutor(max_workers=args.workers)
+
+    try:
+        print(f'{args.routers} routers, {len(links)} links, latency {args.latency}s, {args.workers} workers')
+
+        # First cycle connects, reconciles configuration and enables LLDP
+        print(f'Connect cycle: {discovery_cycle(executor, devices):.3f}s, {sum(1 for device in devices if device.manager)} connected')
+
+        times = [discovery_cycle(executor, devices) for i in range(args.cycles)]
+        neighbors = sum(len(device.neighbors) for device in devices)
+
+        print(f'Discovery cycle: {summary(times)}, {neighbors}/{2 * len(links)} neighbors found')
+
+        if args.notifications:
+            subscriptions = [device.subscription for device in devices]
+            print(f'Subscriptions: {subscriptions.count("yang-push")} YANG-push, {subscriptions.count("netconf")} NETCONF stream, {subscriptions.count(None)} polled, '
+                  f'{sum(router.notified for router in simulator.routers.values())} notifications sent')
+
+        for (generation, name) in enumerate(['Initial push', 'Delta push']):
+            configurations = build_configurations(args, links, generation)
+            (seconds, operations, failed) = push(executor, devices, configurations, not args.no_batch)
+
+            print(f'{name}: {operations} operations in {seconds:.3f}s ({operations / seconds:.1f} ops/s), {failed} failed')
+
+        rpcs = sum(router.rpcs for router in simulator.routers.values())
+        print(f'RPCs answered: {rpcs}')
+
+        # Operations over all devices, by total time spent
+        operations = {}
+
+        for device_operations in metrics.to_dict()['devices'].values():
+            for (operation, histogram) in device_operations.items():
+                (count, total, p95) = operations.get(operation, (0, 0, 0))
+                operations[operation] = (count + histogram['count'], total + histogram['mean'] * histogram['count'], max(p95, histogram['p95']))
+
+        for (operation, (count, total, p95)) in sorted(operations.items(), key=lambda item: -item[1][1])[:8]:
+            print(f'  {operation}: {count} calls, {total:.3f}s total, p95 <= {p95:.3f}s')
+    finally:
+        executor.shutdown(wait=False)
+        simulator.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,228 @@
+import argparse
+import logging
+import os
+import time
+import tracemalloc
+
+from ncclient.operations.retrieve import GetReply
+
+from src.controllers import parsers
+from src.controllers.netconf import Device
+
+# Microbenchmark of the CPU spent by Device building edit-config payloads and parsing replies, without devices or sockets.
+# Replies are replayed from fixtures at realistic sizes (48-port routers, 5k ACL entries, 10k static routes).
+# Generated fixtures follow the IOS-XE reply format, captured ones (raw <rpc-reply> as in ncclient reply.xml) replace them
+# when found in --fixtures: discovery.xml, acls.xml, routes.xml, route-maps.xml. Use --save to write the generated ones.
+# Run from the repository root: python -m benchmarks.payloads --ports 48 --acl-entries 5000 --routes 10000
+
+NC = 'urn:ietf:params:xml:ns:netconf:base:1.0'
+
+def rpc_reply(data):
+    return f'<rpc-reply xmlns="{NC}" message-id="urn:uuid:00000000-0000-0000-0000-000000000000"><data>{data}</data></rpc-reply>'
+
+# Combined LLDP and openconfig-interfaces reply of discovery (see Device.get_discovery_replies), every port with one neighbor
+def discovery_fixture(ports):
+    lldp = []
+    interfaces = []
+
+    for i in range(ports):
+        name = f'GigabitEthernet{i + 1}'
+
+        lldp.append(f'<interface><name>{name}</name><state><enabled>true</enabled></state><neighbors><neighbor><id>R{i}</id>'
+                    f'<state><system-name>R{i}</system-name><port-id>GigabitEthernet2</port-id></state></neighbor></neighbors></interface>')
+        interfaces.append(f'<interface><name>{name}</name><state><enabled>true</enabled></state>'
+                          f'<ethernet xmlns="http://openconfig.net/yang/interfaces/ethernet"><state><mac-address>52:54:00:00:{i >> 8:02x}:{i & 0xff:02x}</mac-address></state></ethernet></interface>')
+
+    return rpc_reply(f'<lldp xmlns="http://openconfig.net/yang/lldp"><interfaces>{"".join(lldp)}</interfaces></lldp>'
+                     f'<interfaces xmlns="http://openconfig.net/yang/interfaces">{"".join(interfaces)}</interfaces>')
+
+# openconfig-acl reply with one ACL set of entries TCP blocks
+def acls_fixture(entries):
+    acl_entries = []
+
+    for seq in range(1, entries + 1):
+        acl_entries.append(f'<acl-entry><sequence-id>{seq}</sequence-id><config><sequence-id>{seq}</sequence-id></config>'
+                           f'<ipv4><config><source-address>10.{seq >> 8 & 0xff}.{seq & 0xff}.0/24</source-address><destination-address>0.0.0.0/0</destination-address><protocol>6</protocol></config></ipv4>'
+                           f'<transport><config><source-port>ANY</source-port><destination-port>{1000 + seq}</destination-port></config></transport>'
+                           f'<actions><config><forwarding-action>DROP</forwarding-action><log-action>LOG_NONE</log-action></config></actions></acl-entry>')
+
+    return rpc_reply(f'<acl xmlns="http://openconfig.net/yang/acl"><acl-sets><acl-set><name>ACL_R0</name><type>ACL_IPV4</type>'
+                     f'<config><name>ACL_R0</name><type>ACL_IPV4</type></config><acl-entries>{"".join(acl_entries)}</acl-entries></acl-set></acl-sets></acl>')
+
+# openconfig-network-instance reply with routes static routes in the default instance
+def routes_fixture(routes):
+    statics = []
+
+    for k in range(routes):
+        prefix = f'172.{16 + (k >> 16)}.{k >> 8 & 0xff}.{k & 0xff}/32'
+
+        statics.append(f'<static><prefix>{prefix}</prefix><config><prefix>{prefix}</prefix></config><next-hops><next-hop><index>GigabitEthernet2_10.0.0.2_{prefix}</index>'
+                       f'<config><index>GigabitEthernet2_10.0.0.2_{prefix}</index><next-hop>10.0.0.2</next-hop><metric>1</metric></config>'
+                       f'<interface-ref><config><interface>GigabitEthernet2</interface></config></interface-ref></next-hop></next-hops></static>')
+
+    return rpc_reply(f'<network-instances xmlns="http://openconfig.net/yang/network-instance"><network-instance><name>default</name><protocols><protocol>'
+                     f'<identifier xmlns:oc-pol-types="http://openconfig.net/yang/policy-types">oc-pol-types:STATIC</identifier><name>DEFAULT</name>'
+                     f'<static-routes>{"".join(statics)}</static-routes></protocol></protocols></network-instance></network-instances>')
+
+# IOS-XE native reply with one route-map of entries statements
+def route_maps_fixture(entries):
+    statements = []
+
+    for seq in range(1, entries + 1):
+        statements.append(f'<route-map-without-order-seq xmlns="http://cisco.com/ns/yang/Cisco-IOS-XE-route-map"><seq_no>{seq}</seq_no><operation>permit</operation>'
+                          f'<set><ip><next-hop><address>10.0.0.2</address></next-hop></ip></set>'
+                          f'<match><ip><address><access-list>ACL_route-f_R0_{seq}</access-list></address></ip></match></route-map-without-order-seq>')
+
+    return rpc_reply(f'<native xmlns="http://cisco.com/ns/yang/Cisco-IOS-XE-native"><route-map><name>MAP_R0</name>{"".join(statements)}</route-map></native>')
+
+# Fixtures {name: raw reply}, captured ones from directory replace generated ones
+def load_fixtures(args):
+    fixtures = {
+        'discovery': discovery_fixture(args.ports),
+        'acls': acls_fixture(args.acl_entries),
+        'routes': routes_fixture(args.routes),
+        'route-maps': route_maps_fixture(args.route_map_entries)
+    }
+
+    for name in fixtures:
+        path = os.path.join(args.fixtures or '', f'{name}.xml')
+
+        if args.fixtures and os.path.exists(path):
+            with open(path, 'r') as file:
+                fixtures[name] = file.read()
+
+            print(f'Using captured {path}')
+
+    return fixtures
+
+# Stands in for the ncclient manager: get replays a fixture, edits are counted and dropped
+class ReplayManager:
+    def __init__(self, reply):
+        self.reply = reply
+        self.connected = True
+        self.edits = 0
+        self.payload_bytes = 0
+
+    def get(self, filter=None):
+        return GetReply(self.reply)
+
+    def edit_config(self, config, target='candidate', **kwargs):
+        self.edits += 1
+        self.payload_bytes += len(config)
+
+    def commit(self):
+        pass
+
+def device(reply=''):
+    device = Device('127.0.0.1', 'R0', 'admin', 'admin')
+    device.logger.setLevel(logging.CRITICAL)
+    device.manager = ReplayManager(reply)
+    device.lldp = True
+    device.bindings_time = float('inf') # Bindings aren't read in this benchmark
+
+    return device
+
+# Run fn(i) for iterations, then once more under tracemalloc.
+# Returns (operations per second, peak KiB of Python allocations per operation). lxml allocates outside the Python heap
+# (libxml2), so parsed trees are only counted through the Python objects built from them
+def measure(fn, iterations):
+    fn(0) # Warm up
+
+    start = time.perf_counter()
+
+    for i in range(iterations):
+        fn(i)
+
+    seconds = time.perf_counter() - start
+
+    tracemalloc.start()
+    fn(iterations)
+    (current, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return (iterations / seconds, peak / 1024)
+
+def report(name, fn, iterations, detail=''):
+    (throughput, peak) = measure(fn, iterations)
+    print(f'  {name}: {throughput:,.1f} ops/s, {1e6 / throughput:,.1f} us/op, peak {peak:,.1f} KiB/op{detail}')
+
+def parsing(args, fixtures):
+    print('Parsing')
+
+    discovery = fixtures['discovery']
+    data = GetReply(discovery).data_ele
+    report(f'discovery reply ({len(discovery) // 1024} KiB)', lambda i: GetReply(discovery).data_ele, args.iterations)
+    report('  fingerprint', lambda i: parsers.fingerprint(GetReply(discovery)), args.iterations)
+    report('  parse_lldp', lambda i: parsers.parse_lldp(data), args.iterations)
+    report('  parse_interfaces', lambda i: parsers.parse_interfaces(data), args.iterations)
+
+    neighbors_device = device(discovery)
+
+    def get_neighbors(i):
+        neighbors_device.replies_fingerprint = None # Process the reply every time
+        neighbors_device.get_neighbors()
+
+    report('  Device.get_neighbors', get_neighbors, args.iterations)
+
+    for (name, parser) in [('acls', parsers.parse_acl_entries), ('routes', parsers.parse_static_routes), ('route-maps', parsers.parse_route_map_entries)]:
+        raw = fixtures[name]
+        data = GetReply(raw).data_ele
+        iterations = max(1, args.iterations // 100)
+
+        report(f'{name} reply ({len(raw) // 1024} KiB)', lambda i: GetReply(raw).data_ele, iterations)
+        report(f'  {parser.__name__}', lambda i: parser(data), iterations)
+
+    acls = fixtures['acls']
+    report('  parse_acl_sets (deconfigure_acls)', lambda i: parsers.parse_acl_sets(GetReply(acls).data_ele), max(1, args.iterations // 100))
+
+def payloads(args):
+    print('Payloads')
+
+    payload_device = device()
+    payload_device.configurations.add('address GigabitEthernet2 10.0.0.1/30')
+    manager = payload_device.manager
+
+    cases = [
+        ('configure_acl', lambda i: payload_device.configure_acl('ACL_R0', i + 1, (f'10.{i >> 8 & 0xff}.{i & 0xff}.0/24', '*', '6', '*', str(1000 + i)))),
+        ('configure_route_map', lambda i: payload_device.configure_route_map(f'10.{i >> 8 & 0xff}.{i & 0xff}.0/24', '*', '17', '*', str(2000 + i), 'GigabitEthernet2', id=i + 1)),
+        ('apply_route_map_interface', lambda i: payload_device.apply_route_map_interface(f'GigabitEthernet{i % args.ports + 1}')),
+        ('apply_acl_interface', lambda i: payload_device.apply_acl_interface(f'GigabitEthernet{i % args.ports + 1}')),
+        ('configure_route', lambda i: payload_device.configure_route(f'172.16.{i >> 8 & 0xff}.{i & 0xff}', '32', 'GigabitEthernet2', '10.0.0.2')),
+        ('configure_address', lambda i: payload_device.configure_address(f'GigabitEthernet{i % args.ports + 1}', f'10.{i >> 8 & 0xff}.{i & 0xff}.1', '30'))
+    ]
+
+    for (name, fn) in cases:
+        (edits, payload_bytes) = (manager.edits, manager.payload_bytes)
+        (throughput, peak) = measure(fn, args.iterations)
+        edits = manager.edits - edits
+
+        print(f'  {name}: {throughput:,.1f} ops/s, {1e6 / throughput:,.1f} us/op, peak {peak:,.1f} KiB/op, '
+              f'{edits / (args.iterations + 2):.0f} edits/op, {(manager.payload_bytes - payload_bytes) / edits:,.0f} bytes/edit')
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark NETCONF payload generation and reply parsing of Device')
+    parser.add_argument('--ports', type=int, default=48, help='Interfaces in the discovery reply')
+    parser.add_argument('--acl-entries', type=int, default=5000)
+    parser.add_argument('--routes', type=int, default=10000)
+    parser.add_argument('--route-map-entries', type=int, default=1000)
+    parser.add_argument('--iterations', type=int, default=1000, help='Iterations of small operations, large replies run a hundredth')
+    parser.add_argument('--fixtures', help='Directory with captured replies replacing generated ones')
+    parser.add_argument('--save', help='Directory to write the generated fixtures to')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    fixtures = load_fixtures(args)
+
+    if args.save:
+        os.makedirs(args.save, exist_ok=True)
+
+        for (name, raw) in fixtures.items():
+            with open(os.path.join(args.save, f'{name}.xml'), 'w') as file:
+                file.write(raw)
+
+    parsing(args, fixtures)
+    payloads(args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,630 @@
+import copy
+import logging
+import random
+import selectors
+import socket
+import threading
+import time
+
+import paramiko
+from lxml import etree
+
+# Simulated IOS-XE routers serving NETCONF over SSH on loopback, for benchmarking NetconfController/Device without real devices.
+# Every router listens on its own port, and answers the openconfig interfaces, LLDP, ACL and network-instance trees,
+# and the IOS-XE native interface/route-map trees queried and edited by Device.
+# Supports get, get-config, edit-config (merge/replace/create/delete/remove), lock/unlock, commit, discard-changes and close-session,
+# with per-router latency, failure injection and a neighbor graph that drives the reported LLDP neighbors.
+# Sessions can subscribe to YANG-push on-change updates (establish/delete-subscription, RFC 8641) or to the NETCONF stream
+# (create-subscription, RFC 5277), and are sent a <notification> when the LLDP neighbors or interface state they watch change.
+
+NC = 'urn:ietf:params:xml:ns:netconf:base:1.0'
+IF = 'http://openconfig.net/yang/interfaces'
+ETH = 'http://openconfig.net/yang/interfaces/ethernet'
+IP = 'http://openconfig.net/yang/interfaces/ip'
+LLDP = 'http://openconfig.net/yang/lldp'
+ACL = 'http://openconfig.net/yang/acl'
+NI = 'http://openconfig.net/yang/network-instance'
+NATIVE = 'http://cisco.com/ns/yang/Cisco-IOS-XE-native'
+NOTIFICATION = 'urn:ietf:params:xml:ns:netconf:notification:1.0'
+SN = 'urn:ietf:params:xml:ns:yang:ietf-subscribed-notifications'
+YP = 'urn:ietf:params:xml:ns:yang:ietf-yang-push'
+
+DELIMITER = b']]>]]>' # NETCONF 1.0 end-of-message, base:1.1 isn't advertised so chunked framing is never used
+
+CAPABILITIES = [
+    'urn:ietf:params:netconf:base:1.0',
+    'urn:ietf:params:netconf:capability:candidate:1.0'
+]
+
+NOTIFICATION_CAPABILITIES = [
+    'urn:ietf:params:netconf:capability:notification:1.0',
+    'urn:ietf:params:netconf:capability:interleave:1.0',
+    f'{YP}?module=ietf-yang-push'
+]
+
+NOTIFY_INTERVAL = 0.1 # Seconds between checks of subscribed state for changes
+
+# Leaves identifying list entries, used to match edited entries with existing ones
+KEYS = {'name', 'id', 'index', 'ip', 'prefix', 'sequence-id', 'seq_no', 'set-name', 'type', 'identifier'}
+
+# RPC answered with <rpc-error>
+class SimulatedError(Exception):
+    def __init__(self, tag, message=''):
+        super(SimulatedError, self).__init__(message)
+        self.tag = tag
+
+def text(element):
+    return (element.text or '').strip()
+
+def children(element):
+    return [child for child in element if isinstance(child.tag, str)] # Skip comments
+
+# Apply RFC 6241 subtree filter to data. Returns a copy of data with only the selected nodes
+def subtree_filter(data, filter):
+    result = etree.Element(data.tag)
+
+    for node in children(filter):
+        for element in data.iterchildren(node.tag):
+            select(element, node, result)
+
+    return result
+
+def select(element, node, result):
+    node_children = children(node)
+
+    # Selection node (empty) or content match node (leaf with text)
+    if len(node_children) == 0:
+        if text(node) == '' or text(node) == text(element):
+            result.append(copy.deepcopy(element))
+        return
+
+    matches = [child for child in node_children if len(child) == 0 and text(child) != '']
+
+    for match in matches:
+        if not any(text(leaf) == text(match) for leaf in element.iterchildren(match.tag)):
+            return
+
+    # Only content match nodes, the whole entry is selected
+    if len(matches) == len(node_children):
+        result.append(copy.deepcopy(element))
+        return
+
+    selected = etree.Element(element.tag)
+
+    for match in matches:
+        for leaf in element.iterchildren(match.tag):
+            if text(leaf) == text(match):
+                selected.append(copy.deepcopy(leaf))
+
+    for child in node_children:
+        if child in matches:
+            continue
+
+        for sub_element in element.iterchildren(child.tag):
+            select(sub_element, child, selected)
+
+    if len(selected) > 0:
+        result.append(selected)
+
+# Existing child of parent matching element: same tag and same key leaves
+def find(parent, element):
+    keys = [(child.tag, text(child)) for child in children(element) if len(child) == 0 and etree.QName(child).localname in KEYS]
+
+    for existing in parent.iterchildren(element.tag):
+        if all(any(text(leaf) == value for leaf in existing.iterchildren(tag)) for (tag, value) in keys):
+            return existing
+
+    return None
+
+# Apply edit-config <config> element on datastore
+def edit(datastore, config):
+    for element in children(config):
+        edit_element(datastore, element, 'merge')
+
+def edit_element(parent, element, operation):
+    operation = element.get(f'{{{NC}}}operation') or element.get('operation') or operation
+    existing = find(parent, element)
+
+    if operation in ('delete', 'remove'):
+        if existing is not None:
+            parent.remove(existing)
+        elif operation == 'delete':
+            raise SimulatedError('data-missing', f'{etree.QName(element).localname} not found')
+        return
+
+    if operation == 'create' and existing is not None:
+        raise SimulatedError('data-exists', f'{etree.QName(element).localname} already exists')
+
+    if operation in ('replace', 'create') and existing is not None:
+        parent.remove(existing)
+        existing = None
+
+    if existing is None:
+        existing = etree.SubElement(parent, element.tag)
+
+    if len(children(element)) == 0:
+        existing.text = text(element)
+        return
+
+    for child in children(element):
+        edit_element(existing, child, operation)
+
+# Simulated router: datastores, neighbor links and fault settings
+class SimulatedRouter:
+    def __init__(self, hostname, port, interfaces=4, latency=0, jitter=0, failure_rate=0, drop_rate=0, enabled=True, notifications=True, on_change=None):
+        self.hostname = hostname
+        self.port = port # SSH port on loopback
+        self.latency = latency # Seconds added to every reply
+        self.jitter = jitter # Random seconds (0 to jitter) added to latency
+        self.failure_rate = failure_rate # Probability of answering an RPC with <rpc-error>
+        self.drop_rate = drop_rate # Probability of dropping the session instead of answering an RPC
+        self.down = False # Refuse new sessions (e.g. router shutdown)
+        self.links = {} # {interface_name: (router, interface_name)}
+        self.rpcs = 0 # Answered RPCs
+        self.notifications = notifications # Supports subscriptions, YANG-push and the NETCONF stream
+        self.on_change = on_change # Xpaths YANG-push on-change subscriptions are accepted for, None for any
+        self.notified = 0 # Sent notifications
+
+        self.running = self.initial_config(interfaces, enabled)
+        self.candidate = copy.deepcopy(self.running)
+
+        # Serializes edits of sessions running in their own threads.
+        # Datastores are replaced, never changed in place, so they can be read without the lock
+        self.lock = threading.Lock()
+
+    # Running configuration of a freshly booted router, GigabitEthernet1 is the management interface
+    def initial_config(self, interfaces, enabled):
+        index = self.port % 256
+        enabled = 'true' if enabled else 'false'
+
+        oc_interfaces = ''.join(f'''
+            <interface>
+                <name>GigabitEthernet{i}</name>
+                <config>
+                    <name>GigabitEthernet{i}</name>
+                    <enabled>{'true' if i == 1 else enabled}</enabled>
+                </config>{f"""
+                <subinterfaces>
+                    <subinterface>
+                        <index>0</index>
+                        <ipv4 xmlns="{IP}">
+                            <addresses>
+                                <address>
+                                    <ip>10.255.{index}.1</ip>
+                                    <config>
+                                        <ip>10.255.{index}.1</ip>
+                                        <prefix-length>24</prefix-length>
+                                    </config>
+                                </address>
+                            </addresses>
+                        </ipv4>
+                    </subinterface>
+                </subinterfaces>""" if i == 1 else ''}
+            </interface>''' for i in range(1, interfaces + 1))
+
+        native_interfaces = ''.join(f'''
+                <GigabitEthernet>
+                    <name>{i}</name>
+                </GigabitEthernet>''' for i in range(1, interfaces + 1))
+
+        return etree.fromstring(f'''
+            <data xmlns="{NC}">
+                <interfaces xmlns="{IF}">{oc_interfaces}
+                </interfaces>
+                <lldp xmlns="{LLDP}">
+                    <config>
+                        <enabled>false</enabled>
+                    </config>
+                </lldp>
+                <network-instances xmlns="{NI}">
+                    <network-instance>
+                        <name>default</name>
+                        <protocols>
+                            <protocol>
+                                <identifier>oc-pol-types:STATIC</identifier>
+                                <name>DEFAULT</name>
+                                <static-routes>
+                                </static-routes>
+                            </protocol>
+                        </protocols>
+                    </network-instance>
+                </network-instances>
+                <acl xmlns="{ACL}">
+                </acl>
+                <native xmlns="{NATIVE}">
+                    <interface>{native_interfaces}
+                    </interface>
+                </native>
+            </data>
+        ''', parser=etree.XMLParser(remove_blank_text=True))
+
+    # Interface is up in the running configuration
+    def interface_enabled(self, interface_name):
+        interface = self.running.find(f'{{{IF}}}interfaces/{{{IF}}}interface[{{{IF}}}name="{interface_name}"]')
+        return interface is not None and interface.findtext(f'{{{IF}}}config/{{{IF}}}enabled') != 'false'
+
+    # LLDP runs on interface in the running configuration
+    def lldp_enabled(self, interface_name):
+        if self.running.findtext(f'{{{LLDP}}}lldp/{{{LLDP}}}config/{{{LLDP}}}enabled') != 'true':
+            return False
+
+        interface = self.running.find(f'{{{LLDP}}}lldp/{{{LLDP}}}interfaces/{{{LLDP}}}interface[{{{LLDP}}}name="{interface_name}"]')
+        return interface is None or interface.findtext(f'{{{LLDP}}}config/{{{LLDP}}}enabled') != 'false'
+
+    # Running configuration with operational state: interface state, MAC addresses and LLDP neighbors
+    def operational(self):
+        data = copy.deepcopy(self.running)
+        lldp_interfaces = data.find(f'{{{LLDP}}}lldp/{{{LLDP}}}interfaces')
+
+        if lldp_interfaces is None:
+            lldp_interfaces = etree.SubElement(data.find(f'{{{LLDP}}}lldp'), f'{{{LLDP}}}interfaces')
+
+        for (i, interface) in enumerate(data.iterfind(f'{{{IF}}}interfaces/{{{IF}}}interface')):
+            name = interface.findtext(f'{{{IF}}}name')
+            enabled = self.interface_enabled(name)
+
+            state = etree.SubElement(interface, f'{{{IF}}}state')
+            etree.SubElement(state, f'{{{IF}}}enabled').text = 'true' if enabled else 'false'
+
+            ethernet = etree.SubElement(interface, f'{{{ETH}}}ethernet')
+            mac = etree.SubElement(etree.SubElement(ethernet, f'{{{ETH}}}state'), f'{{{ETH}}}mac-address')
+            mac.text = ':'.join(f'{b:02x}' for b in (0x52, 0x54, self.port >> 8 & 0xff, self.port & 0xff, 0, i + 1))
+
+            lldp_interface = lldp_interfaces.find(f'{{{LLDP}}}interface[{{{LLDP}}}name="{name}"]')
+
+            if lldp_interface is None:
+                lldp_interface = etree.SubElement(lldp_interfaces, f'{{{LLDP}}}interface')
+                etree.SubElement(lldp_interface, f'{{{LLDP}}}name').text = name
+
+            lldp = self.lldp_enabled(name)
+
+            lldp_state = etree.SubElement(lldp_interface, f'{{{LLDP}}}state')
+            etree.SubElement(lldp_state, f'{{{LLDP}}}enabled').text = 'true' if lldp else 'false'
+
+            neighbors = etree.SubElement(lldp_interface, f'{{{LLDP}}}neighbors')
+            (peer, peer_interface) = self.links.get(name, (None, None))
+
+            if peer is not None and enabled and lldp and not peer.down:
+                if peer.interface_enabled(peer_interface) and peer.lldp_enabled(peer_interface):
+                    neighbor = etree.SubElement(neighbors, f'{{{LLDP}}}neighbor')
+                    etree.SubElement(neighbor, f'{{{LLDP}}}id').text = peer.hostname
+                    neighbor_state = etree.SubElement(neighbor, f'{{{LLDP}}}state')
+                    etree.SubElement(neighbor_state, f'{{{LLDP}}}system-name').text = peer.hostname
+                    etree.SubElement(neighbor_state, f'{{{LLDP}}}port-id').text = peer_interface
+
+        return data
+
+    # State watched by subscriptions, as bytes compared between checks. YANG-push subscriptions watch LLDP neighbors and
+    # interface state, the NETCONF stream also reports configuration changes
+    def watched_state(self, stream):
+        data = self.operational()
+
+        if stream:
+            return etree.tostring(data)
+
+        watched = [data.find(f'{{{LLDP}}}lldp/{{{LLDP}}}interfaces')]
+        watched += data.iterfind(f'{{{IF}}}interfaces/{{{IF}}}interface/{{{IF}}}state')
+
+        return b''.join(etree.tostring(element) for element in watched)
+
+    # Answer RPC element. Returns the reply content (<data> or <ok/>), raises SimulatedError for <rpc-error>
+    def rpc(self, operation):
+        name = etree.QName(operation).localname
+
+        if random.random() < self.failure_rate:
+            raise SimulatedError('operation-failed', 'Injected failure')
+
+        self.rpcs += 1
+
+        if name == 'get':
+            data = self.operational()
+        elif name == 'get-config':
+            data = self.datastore(operation.find(f'{{{NC}}}source'))
+        else:
+            return self.write(name, operation)
+
+        filter = operation.find(f'{{{NC}}}filter')
+        data = subtree_filter(data, filter) if filter is not None else copy.deepcopy(data)
+        data.tag = f'{{{NC}}}data'
+
+        return data
+
+    # Answer RPC changing a datastore
+    def write(self, name, operation):
+        with self.lock:
+            if name == 'edit-config':
+                config = operation.find(f'{{{NC}}}config')
+                target = self.datastore(operation.find(f'{{{NC}}}target'))
+                edited = copy.deepcopy(target) # Edit is applied whole or not at all
+
+                edit(edited, config)
+
+                if target is self.running:
+                    self.running = edited
+                else:
+                    self.candidate = edited
+
+                return etree.Element(f'{{{NC}}}ok')
+            elif name == 'commit':
+                self.running = copy.deepcopy(self.candidate)
+                return etree.Element(f'{{{NC}}}ok')
+            elif name == 'discard-changes':
+                self.candidate = copy.deepcopy(self.running)
+                return etree.Element(f'{{{NC}}}ok')
+            elif name in ('lock', 'unlock', 'close-session'):
+                return etree.Element(f'{{{NC}}}ok')
+            else:
+                raise SimulatedError('operation-not-supported', f'{name} is not supported')
+
+    # Datastore named by <source>/<target> element
+    def datastore(self, element):
+        if element is not None and element.find(f'{{{NC}}}candidate') is not None:
+            return self.candidate
+
+        return self.running
+
+# NETCONF session of a router, with its subscriptions. Replies and notifications are sent from different threads
+class Session:
+    def __init__(self, channel, router, id):
+        self.channel = channel
+        self.router = router
+        self.id = id
+        self.subscriptions = set() # IDs of YANG-push subscriptions
+        self.stream = False # Subscribed to the NETCONF stream
+        self.state = None # Watched state when last checked, see SimulatedRouter.watched_state
+        self.send_lock = threading.Lock()
+
+    def send(self, message):
+        with self.send_lock:
+            self.channel.sendall(message.encode() + DELIMITER)
+
+    def subscribed(self):
+        return self.stream or len(self.subscriptions) > 0
+
+    # Answer subscription RPC. Returns the reply content, raises SimulatedError for <rpc-error>
+    def subscribe(self, name, operation, next_id):
+        if not self.router.notifications:
+            raise SimulatedError('operation-not-supported', f'{name} is not supported')
+
+        if name == 'establish-subscription':
+            xpath = text(operation.find(f'{{{YP}}}datastore-xpath-filter'))
+
+            if self.router.on_change is not None and xpath not in self.router.on_change:
+                raise SimulatedError('operation-failed', f'on-change-unsupported: {xpath}')
+
+            self.subscriptions.add(next_id)
+            self.watch()
+
+            id = etree.Element(f'{{{SN}}}id')
+            id.text = str(next_id)
+            return id
+        elif name == 'delete-subscription':
+            id = text(operation.find(f'{{{SN}}}id'))
+
+            if not id.isdigit() or int(id) not in self.subscriptions:
+                raise SimulatedError('invalid-value', f'no-such-subscription: {id}')
+
+            self.subscriptions.remove(int(id))
+        else: # create-subscription
+            if self.stream:
+                raise SimulatedError('operation-failed', 'Already subscribed')
+
+            self.stream = True
+            self.watch()
+
+        return etree.Element(f'{{{NC}}}ok')
+
+    # Record watched state, changes after it are notified
+    def watch(self):
+        self.state = self.router.watched_state(self.stream)
+
+    # Send a notification per subscription if the watched state changed since the last check
+    def check(self):
+        state = self.router.watched_state(self.stream)
+
+        if state == self.state:
+            return
+
+        self.state = state
+        event_time = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+
+        if self.stream:
+            self.send(f'<notification xmlns="{NOTIFICATION}"><eventTime>{event_time}</eventTime><netconf-config-change xmlns="urn:ietf:params:xml:ns:yang:ietf-netconf-notifications"/></notification>')
+            self.router.notified += 1
+
+        for id in sorted(self.subscriptions):
+            self.send(f'<notification xmlns="{NOTIFICATION}"><eventTime>{event_time}</eventTime><push-change-update xmlns="{YP}"><id>{id}</id></push-change-update></notification>')
+            self.router.notified += 1
+
+# Accepts SSH sessions and runs the netconf subsystem
+class SSHServer(paramiko.ServerInterface):
+    def __init__(self, simulator, router):
+        self.simulator = simulator
+        self.router = router
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED_OR_UNKNOWN_CHANNEL_TYPE
+
+    def check_channel_subsystem_request(self, channel, name):
+        if name != 'netconf':
+            return False
+
+        threading.Thread(target=self.simulator.serve, args=(channel, self.router), daemon=True).start()
+
+        return True
+
+# Simulated routers on loopback. Routers are added and linked before start()
+class Simulator:
+    def __init__(self, host='127.0.0.1', base_port=18300):
+        self.host = host
+        self.base_port = base_port # Port of the first router, the others use the following ports
+        self.routers = {} # {hostname: SimulatedRouter}
+        self.sockets = {} # {listening socket: router}
+        self.selector = selectors.DefaultSelector()
+        self.sessions = 0 # Last session ID
+        self.subscriptions = 0 # Last subscription ID
+        self.active = {} # {session ID: Session} of sessions with subscriptions
+        self.running = False
+
+        self.host_key = paramiko.RSAKey.generate(2048) # Shared by all routers
+
+        self.logger = logging.getLogger('NetconfSimulator')
+
+    def add_router(self, hostname, **kwargs):
+        router = SimulatedRouter(hostname, self.base_port + len(self.routers), **kwargs)
+        self.routers[hostname] = router
+        return router
+
+    # Connect interface_a of router a with interface_b of router b, both report each other as LLDP neighbor
+    def link(self, a, interface_a, b, interface_b):
+        self.routers[a].links[interface_a] = (self.routers[b], interface_b)
+        self.routers[b].links[interface_b] = (self.routers[a], interface_a)
+
+    def start(self):
+        for router in self.routers.values():
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind((self.host, router.port))
+            sock.listen(128)
+            sock.setblocking(False)
+
+            self.sockets[sock] = router
+            self.selector.register(sock, selectors.EVENT_READ)
+
+        self.running = True
+
+        threading.Thread(target=self.accept_loop, daemon=True).start()
+        threading.Thread(target=self.notify_loop, daemon=True).start()
+
+        self.logger.info(f'Simulating {len(self.routers)} routers on {self.host}:{self.base_port}-{self.base_port + len(self.routers) - 1}')
+
+    def stop(self):
+        self.running = False
+
+        for sock in self.sockets:
+            self.selector.unregister(sock)
+            sock.close()
+
+        self.sockets = {}
+
+    # One thread accepts connections for every router, each session then runs in its own threads
+    def accept_loop(self):
+        while self.running:
+            for (key, events) in self.selector.select(timeout=0.5):
+                router = self.sockets.get(key.fileobj)
+
+                try:
+                    (connection, address) = key.fileobj.accept()
+                except OSError:
+                    continue
+
+                if router.down:
+                    connection.close()
+                    continue
+
+                connection.setblocking(True)
+                threading.Thread(target=self.handshake, args=(connection, router), daemon=True).start()
+
+    # One thread checks the state watched by every subscribed session, and sends notifications of changes
+    def notify_loop(self):
+        while self.running:
+            time.sleep(NOTIFY_INTERVAL)
+
+            for session in list(self.active.values()):
+                try:
+                    session.check()
+                except Exception as e:
+                    self.logger.debug(f'Notification on {session.router.hostname} failed: {str(e)}')
+                    self.active.pop(session.id, None)
+
+    def handshake(self, connection, router):
+        transport = paramiko.Transport(connection)
+        transport.add_server_key(self.host_key)
+
+        try:
+            transport.start_server(server=SSHServer(self, router))
+        except Exception as e:
+            self.logger.debug(f'SSH negotiation failed on {router.hostname}: {str(e)}')
+            transport.close()
+
+    # Run NETCONF session on channel: exchange hellos, then answer RPCs until the session is closed
+    def serve(self, channel, router):
+        self.sessions += 1
+        session = Session(channel, router, self.sessions)
+
+        capabilities = ''.join(f'<capability>{capability}</capability>' for capability in CAPABILITIES + (NOTIFICATION_CAPABILITIES if router.notifications else []))
+        session.send(f'<hello xmlns="{NC}"><capabilities>{capabilities}</capabilities><session-id>{session.id}</session-id></hello>')
+
+        buffer = b''
+        hello = True
+
+        try:
+            while not channel.closed:
+                data = channel.recv(65536)
+
+                if not data:
+                    break
+
+                buffer += data
+
+                while DELIMITER in buffer:
+                    (message, buffer) = buffer.split(DELIMITER, 1)
+
+                    if hello: # Client hello, nothing to answer
+                        hello = False
+                        continue
+
+                    if random.random() < router.drop_rate or router.down:
+                        channel.get_transport().close()
+                        return
+
+                    if not self.answer(session, message):
+                        channel.get_transport().close()
+                        return
+        except Exception as e:
+            self.logger.debug(f'Session on {router.hostname} failed: {str(e)}')
+        finally:
+            self.active.pop(session.id, None) # Subscriptions end with their session
+            channel.close()
+
+    # Answer one <rpc>. Returns False after close-session
+    def answer(self, session, message):
+        router = session.router
+        rpc = etree.fromstring(message.strip())
+        operation = children(rpc)[0]
+        name = etree.QName(operation).localname
+        attributes = ''.join(f' {key}="{value}"' for (key, value) in rpc.attrib.items() if '}' not in key)
+
+        try:
+            if name in ('establish-subscription', 'delete-subscription', 'create-subscription'):
+                self.subscriptions += 1
+                content = etree.tostring(session.subscribe(name, operation, self.subscriptions)).decode()
+
+                if session.subscribed():
+                    self.active[session.id] = session
+                else:
+                    self.active.pop(session.id, None)
+            else:
+                content = etree.tostring(router.rpc(operation)).decode()
+        except SimulatedError as e:
+            content = f'''<rpc-error><error-type>application</error-type><error-tag>{e.tag}</error-tag><error-severity>error</error-severity><error-message>{str(e)}</error-message></rpc-error>'''
+        except etree.LxmlError as e:
+            content = f'''<rpc-error><error-type>protocol</error-type><error-tag>malformed-message</error-tag><error-severity>error</error-severity><error-message>{str(e)}</error-message></rpc-error>'''
+
+        delay = router.latency + random.uniform(0, router.jitter)
+
+        if delay > 0:
+            time.sleep(delay)
+
+        session.send(f'<rpc-reply xmlns="{NC}"{attributes}>{content}</rpc-reply>')
+
+        return name != 'close-session'
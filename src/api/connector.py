@@ -6,7 +6,7 @@ from ryu.base import app_manager
 from ryu.controller.handler import set_ev_cls
 
 from ryu.lib import hub
-from src.events import EventClassicDeviceAPI, EventPolicies, EventPolicyAPI, EventSdnDeviceAPI, EventTopology, EventClassicConfigurations, EventSdnConfigurations
+from src.events import EventClassicDeviceAPI, EventPolicies, EventPolicyAPI, EventSdnDeviceAPI, EventTopology, EventClassicConfigurations, EventSdnConfigurations, EventNetconfMetrics
 import src.api.host as host
 
 url = f'http://{host.host}:8000'
@@ -54,6 +54,13 @@ class ApiConnector(app_manager.RyuApp):
         except Exception as e:
             self.logger.error(f'Failed to send SDN configurations to API: {str(e)}')
     
+    @set_ev_cls(EventNetconfMetrics)
+    def netconf_metrics_handler(self, ev):
+        try:
+            requests.put(f'{url}/metrics/netconf', json=ev.metrics)
+        except Exception as e:
+            self.logger.error(f'Failed to send NETCONF metrics to API: {str(e)}')
+
     @set_ev_cls(EventPolicies)
     def policies_handler(self, ev):
         try:
@@ -35,6 +35,10 @@ policies = {
     "policies": []
 }
 
+metrics = {
+    "netconf": {}
+}
+
 queue = []
 
 @app.get("/")
@@ -74,6 +78,21 @@ def update_policies(new_policies: List[dict]):
     policies["policies"] = new_policies
     return {"policies": policies}
 
+@app.get("/metrics")
+def read_metrics():
+    return metrics
+
+@app.put("/metrics/netconf")
+def update_netconf_metrics(netconf_metrics: dict):
+    metrics["netconf"] = netconf_metrics
+    return {"netconf": metrics["netconf"]}
+
+# Onboard many classic devices with one instruction, [{"name": X, "ip_address": X}, ...]
+@app.post("/devices/classic")
+def onboard_classic_devices(devices: List[dict]):
+    queue.append(' '.join(['device Classic new'] + [f'{device["name"]} {device["ip_address"]}' for device in devices]))
+    return {"devices": len(devices)}
+
 @app.get("/queue")
 def read_queue():
     read = queue.copy()
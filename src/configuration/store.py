@@ -0,0 +1,131 @@
+# Configuration string parsed into its parts, e.g. 'route 192.168.1.1/24 GigabitEthernet2 192.168.99.2'
+class Configuration:
+    def __init__(self, text):
+        split = text.split(' ')
+
+        self.text = text
+        self.kind = split[0] # address, route, block, route-f or disable
+        self.args = split[1:]
+        self.interface = self.get_interface()
+        self.prefix = self.get_prefix()
+
+    # Interface/port the configuration is bound to, None for configurations not bound to one (block)
+    def get_interface(self):
+        if len(self.args) == 0:
+            return None
+
+        if self.kind == 'address' or self.kind == 'disable':
+            return self.args[0]
+        elif self.kind == 'route' and len(self.args) > 1:
+            return self.args[1]
+        elif self.kind == 'route-f':
+            return self.args[-1]
+
+        return None
+
+    # (network address, prefix length) of a route's destination, e.g. ('192.168.1.0', '24'),
+    # None for other configurations and invalid routes
+    def get_prefix(self):
+        if self.kind != 'route' or len(self.args) != 3:
+            return None
+
+        try:
+            (address, prefix) = self.args[0].split('/')
+            octets = [int(octet) for octet in address.split('.')]
+            length = int(prefix)
+        except ValueError:
+            return None
+
+        if len(octets) != 4 or not 0 <= length <= 32:
+            return None
+
+        value = sum(octet << (24 - 8 * i) for (i, octet) in enumerate(octets))
+        value &= (0xffffffff << (32 - length)) & 0xffffffff
+
+        return ('.'.join(str(value >> shift & 0xff) for shift in (24, 16, 8, 0)), prefix)
+
+# Set of applied configurations, in insertion order, with indexes by kind, by interface and by route prefix.
+# Membership, add, remove and lookups are O(1), so diffing is linear in the number of configurations.
+class ConfigurationStore:
+    def __init__(self, confs=()):
+        self.entries = {} # {text: Configuration}
+        self.kinds = {} # {kind: {text: None}}
+        self.interfaces = {} # {interface: {text: None}}
+        self.prefixes = {} # {(network, prefix): {text: None}}, routes by destination
+
+        for conf in confs:
+            self.add(conf)
+
+    def __contains__(self, conf):
+        return conf in self.entries
+
+    def __iter__(self):
+        return iter(list(self.entries))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __repr__(self):
+        return repr(list(self.entries))
+
+    # Add configuration, does nothing if already present
+    def add(self, conf):
+        if conf in self.entries:
+            return
+
+        entry = Configuration(conf)
+        self.entries[conf] = entry
+
+        self.kinds.setdefault(entry.kind, {})[conf] = None
+
+        if entry.interface is not None:
+            self.interfaces.setdefault(entry.interface, {})[conf] = None
+
+        if entry.prefix is not None:
+            self.prefixes.setdefault(entry.prefix, {})[conf] = None
+
+    # Remove configuration, raises KeyError if not present
+    def remove(self, conf):
+        entry = self.entries.pop(conf)
+
+        self.kinds[entry.kind].pop(conf)
+
+        if entry.interface is not None:
+            self.interfaces[entry.interface].pop(conf)
+
+        if entry.prefix is not None:
+            self.prefixes[entry.prefix].pop(conf)
+
+    def discard(self, conf):
+        if conf in self.entries:
+            self.remove(conf)
+
+    # Configuration strings of a kind
+    def by_kind(self, kind):
+        return list(self.kinds.get(kind, ()))
+
+    # Configuration strings bound to an interface, optionally only of a kind
+    def by_interface(self, interface, kind=None):
+        confs = self.interfaces.get(interface, ())
+
+        if kind is None:
+            return list(confs)
+
+        return [conf for conf in confs if self.entries[conf].kind == kind]
+
+    # Route configuration strings to a destination network, e.g. by_prefix('192.168.1.0', '24')
+    def by_prefix(self, network, prefix):
+        return list(self.prefixes.get((network, prefix), ()))
+
+    # Returns (removed, added): configurations to deconfigure and to configure to go from this store to confs.
+    # Duplicates in confs are configured once. Safe to call while another thread changes the store
+    def diff(self, confs):
+        new = dict.fromkeys(confs)
+
+        removed = [conf for conf in list(self.entries) if conf not in new]
+        added = [conf for conf in new if conf not in self.entries]
+
+        return (removed, added)
+
+    def copy(self):
+        return ConfigurationStore(self.entries)
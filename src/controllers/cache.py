@@ -0,0 +1,33 @@
+import time
+
+# Operational state of a device, parsed from replies, kept for ttl seconds.
+# Filled by discovery, read by configuration operations instead of a get of their own, and invalidated by edits that change it.
+# Not thread-safe, used under the device lock
+class OperationalCache:
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.entries = {} # {name: (time, value)}
+
+    # Cached value, None if missing or expired
+    def get(self, name):
+        entry = self.entries.get(name)
+
+        if entry is None or time.time() - entry[0] > self.ttl:
+            return None
+
+        return entry[1]
+
+    def put(self, name, value):
+        self.entries[name] = (time.time(), value)
+
+    # Mark cached value as fresh, when the device reported the same state again
+    def touch(self, name):
+        if name in self.entries:
+            self.entries[name] = (time.time(), self.entries[name][1])
+
+    # Drop cached value, or all values if no name is given
+    def invalidate(self, name=None):
+        if name is None:
+            self.entries = {}
+        else:
+            self.entries.pop(name, None)
@@ -0,0 +1,121 @@
+import logging
+import os
+import queue
+import threading
+
+from src.controllers.state import StateStore
+
+# Device inventory: name, IP address and datapath ID of every device, indexed for O(1) lookup by each.
+# Records are {'name': X, 'ip': X, 'dpid': X}, keyed by IP address, or by datapath ID for devices without one.
+# Changes update the indexes at once, and are appended to a StateStore log (compacted as it grows) by a background thread,
+# so event handlers never wait for disk I/O. Changes made together (e.g. onboarding many devices) are written together.
+# Only used by the Ryu thread, the background thread only writes the log
+class Inventory:
+    def __init__(self, path):
+        self.new = not os.path.exists(path) # No inventory yet, devices can be imported from the old config files
+
+        self.store = StateStore(path)
+        self.records = {} # {key: record}
+        self.names = {} # {name: key}
+        self.ips = {} # {ip: key}
+        self.dpids = {} # {dpid: key}
+
+        for (key, record) in self.store.states.items():
+            self.index(key, record)
+
+        self.logger = logging.getLogger('Inventory')
+
+        self.writes = queue.SimpleQueue() # (key, record) changes not written yet, record is None for removed devices
+        self.writer = threading.Thread(target=self.write, name=f'inventory-{os.path.basename(path)}', daemon=True)
+        self.writer.start()
+
+    def __iter__(self):
+        return iter(list(self.records.values()))
+
+    def __len__(self):
+        return len(self.records)
+
+    def get(self, name):
+        return self.records.get(self.names.get(name))
+
+    def by_ip(self, ip):
+        return self.records.get(self.ips.get(ip))
+
+    def by_dpid(self, dpid):
+        return self.records.get(self.dpids.get(dpid))
+
+    def add(self, name, ip=None, dpid=None):
+        added = self.add_all([{'name': name, 'ip': ip, 'dpid': dpid}])
+
+        return added[0] if len(added) > 0 else None
+
+    # Add many devices at once. Devices with a name, IP address or datapath ID already in the inventory are skipped.
+    # Returns added records
+    def add_all(self, records):
+        added = []
+
+        for record in records:
+            record = {'name': record['name'], 'ip': record.get('ip'), 'dpid': record.get('dpid')}
+            key = self.key(record)
+
+            if key in self.records or record['name'] in self.names or (record['dpid'] is not None and record['dpid'] in self.dpids):
+                self.logger.warning(f'Skipping device already in inventory: {record}')
+                continue
+
+            self.index(key, record)
+            self.writes.put((key, record))
+            added.append(record)
+
+        return added
+
+    # Rename device. Returns the renamed record, None if old_name isn't in the inventory
+    def rename(self, old_name, new_name):
+        key = self.names.pop(old_name, None)
+
+        if key is None:
+            return None
+
+        record = dict(self.records[key], name=new_name)
+
+        self.index(key, record)
+        self.writes.put((key, record))
+
+        return record
+
+    def remove(self, name):
+        key = self.names.pop(name, None)
+
+        if key is None:
+            return
+
+        record = self.records.pop(key)
+        self.ips.pop(record['ip'], None)
+        self.dpids.pop(record['dpid'], None)
+
+        self.writes.put((key, None))
+
+    def key(self, record):
+        return record['ip'] if record['ip'] is not None else str(record['dpid'])
+
+    def index(self, key, record):
+        self.records[key] = record
+        self.names[record['name']] = key
+
+        if record['ip'] is not None:
+            self.ips[record['ip']] = key
+
+        if record['dpid'] is not None:
+            self.dpids[record['dpid']] = key
+
+    # Background thread, writes queued changes. Changes queued while writing are written together next
+    def write(self):
+        while True:
+            items = [self.writes.get()]
+
+            while not self.writes.empty():
+                items.append(self.writes.get())
+
+            try:
+                self.store.put_all(items)
+            except Exception as e:
+                self.logger.error(f'Failed to write inventory to {self.store.path}: {str(e)}')
@@ -0,0 +1,123 @@
+import bisect
+import sys
+import threading
+import time
+
+# Upper bounds (seconds) of latency histogram buckets, doubling from 1ms to ~65s. Slower calls go to a last, unbounded bucket
+BUCKETS = [0.001 * 2 ** i for i in range(17)]
+
+# ncclient manager methods sending an RPC, other attributes are passed through without timing
+RPCS = {'get', 'get_config', 'edit_config', 'commit', 'discard_changes', 'lock', 'unlock', 'dispatch', 'create_subscription', 'close_session'}
+
+# Latency histogram and error count of one operation on one device
+class Histogram:
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.errors = 0
+        self.total = 0 # Sum of latencies
+        self.max = 0
+
+    def record(self, latency, error):
+        self.buckets[bisect.bisect_left(BUCKETS, latency)] += 1
+        self.count += 1
+        self.errors += 1 if error else 0
+        self.total += latency
+        self.max = max(self.max, latency)
+
+    # Latency of quantile q, as the upper bound of the bucket it falls in
+    def quantile(self, q):
+        rank = q * self.count
+        seen = 0
+
+        for (i, count) in enumerate(self.buckets):
+            seen += count
+
+            if seen >= rank and count > 0:
+                return BUCKETS[i] if i < len(BUCKETS) else self.max
+
+        return 0
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'mean': self.total / self.count if self.count > 0 else 0,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+            'max': self.max,
+            'buckets': self.buckets
+        }
+
+# Per-device, per-operation latency histograms of NETCONF calls.
+# Recorded from discovery worker threads and from the Ryu thread, read by NetconfController for the REST API
+class RpcMetrics:
+    def __init__(self):
+        self.histograms = {} # {device: {operation: Histogram}}
+        self.lock = threading.Lock()
+
+    def record(self, device, operation, latency, error=False):
+        with self.lock:
+            operations = self.histograms.setdefault(device, {})
+            histogram = operations.get(operation)
+
+            if histogram is None:
+                histogram = operations[operation] = Histogram()
+
+            histogram.record(latency, error)
+
+    # Stop reporting a device (deleted or renamed)
+    def remove(self, device):
+        with self.lock:
+            self.histograms.pop(device, None)
+
+    # {'buckets': [bound, ...], 'devices': {device: {operation: {...}}}}
+    def to_dict(self):
+        with self.lock:
+            return {
+                'buckets': BUCKETS,
+                'devices': {device: {operation: histogram.to_dict() for (operation, histogram) in operations.items()}
+                            for (device, operations) in self.histograms.items()}
+            }
+
+# Wraps ncclient manager, recording latency and errors of every RPC in metrics.
+# Operations are named after the manager method and the Device method calling it, e.g. 'edit_config/configure_route',
+# so the same RPC is told apart by what it's used for
+class InstrumentedManager:
+    def __init__(self, manager, metrics, device):
+        # Set directly, __setattr__ forwards to the wrapped manager
+        self.__dict__['manager'] = manager
+        self.__dict__['metrics'] = metrics
+        self.__dict__['device'] = device
+
+    def __getattr__(self, name):
+        attribute = getattr(self.manager, name)
+
+        if name not in RPCS:
+            return attribute
+
+        def timed(*args, **kwargs):
+            caller = sys._getframe(1)
+
+            # Device.edit wraps edit_config/commit for every configure method, name the configure method instead
+            if caller.f_code.co_name == 'edit':
+                caller = caller.f_back
+
+            operation = f'{name}/{caller.f_code.co_name}'
+            start = time.perf_counter()
+
+            try:
+                result = attribute(*args, **kwargs)
+            except Exception:
+                self.metrics.record(self.device.hostname, operation, time.perf_counter() - start, error=True)
+                raise
+
+            self.metrics.record(self.device.hostname, operation, time.perf_counter() - start)
+
+            return result
+
+        return timed
+
+    def __setattr__(self, name, value):
+        setattr(self.manager, name, value)
@@ -1,16 +1,60 @@
 import re
-import xml.etree.ElementTree as ET
 import logging
+import random
+import threading
+import time
+
+from functools import partial
 
 from ryu.base import app_manager
+from ryu.lib import hub
 from ncclient import manager
+from ncclient.operations import RPCError
+from ncclient.xml_ import to_ele
 from ryu.controller.handler import set_ev_cls
 
-from src.events import EventClassicDeviceAPI, EventPolicyDeviceAPI, RequestNetconfDiscovery, ReplyNetconfDiscovery, EventNetconfConfigurations
+from src.configuration.store import ConfigurationStore
+from src.controllers import parsers
+from src.controllers.cache import OperationalCache
+from src.controllers.inventory import Inventory
+from src.controllers.metrics import RpcMetrics, InstrumentedManager
+from src.controllers.state import StateStore
+from src.controllers.worker import WorkerPool
+from src.events import EventClassicDeviceAPI, EventPolicyDeviceAPI, RequestNetconfDiscovery, ReplyNetconfDiscovery, EventNetconfConfigurations, EventNetconfMetrics
+
+DISCOVERY_WORKERS = 16 # Maximum number of devices discovered at the same time
+DISCOVERY_DEADLINE = 2 # Seconds a discovery cycle waits for devices before returning partial results
+DEVICE_TIMEOUT = 10 # Seconds a single device has for NETCONF connect and for each RPC
+RECONNECT_BACKOFF = 1 # Seconds before retrying a failed connection, doubled after every consecutive failure
+RECONNECT_BACKOFF_MAX = 300 # Upper bound of the reconnect backoff
+MAX_RPC_FAILURES = 3 # Consecutive failed discoveries before a session that still answers is dropped
+PROBE_TIMEOUT = 2 # Seconds a liveness probe waits for a reply
+BINDINGS_RECONCILE_INTERVAL = 60 # Seconds between checks of tracked ACL/route-map interface bindings against the device
+NOTIFICATIONS = False # Event-driven discovery: subscribe to LLDP/interface changes, and only poll devices that reported one. Default of 'notifications' in config/netconf.txt
+SAFETY_POLL_INTERVAL = 60 # Seconds between polls of subscribed devices that reported no change
+STATE_PATH = 'config/netconf_state.jsonl' # Snapshot log of device state, used to resume after a restart
+INVENTORY_PATH = 'config/netconf_inventory.jsonl' # Classic devices (name and IP address), see Inventory
+METRICS_INTERVAL = 5 # Seconds between RPC latency metrics sent to the API
+PUSH_WORKERS = 16 # Maximum number of devices configured at the same time
+PUSH_RETRIES = 3 # Retries of a push with failed operations
+PUSH_RETRY_DELAY = 1 # Seconds before the first retry of a push, doubled after every retry
+DRIFT_RPC_BUDGET = 2 # RPCs per second spent on configuration drift checks, over all devices
+DRIFT_SUBTREES = ['addresses', 'routes', 'acls', 'route-maps'] # Running configuration subtrees checked for drift, one per check
+OPERATIONAL_TTL = 5 # Seconds operational state read by discovery is used by configuration operations
+
+# Order of configuration kinds in a push. Removals run first, in reverse order, then additions in this order,
+# so addresses and routes are up before ACLs and route-maps, and route-maps never outlive the address their next hop comes from
+CONFIGURATION_ORDER = ['address', 'route', 'disable', 'block', 'route-f']
+
+# Position of configuration kind in CONFIGURATION_ORDER, invalid configurations go last
+def configuration_order(conf):
+    kind = conf.split(' ')[0]
+
+    return CONFIGURATION_ORDER.index(kind) if kind in CONFIGURATION_ORDER else len(CONFIGURATION_ORDER)
 
 # Responsible for managing NETCONF communication with NETCONF devices
 class NetconfController(app_manager.RyuApp):
-    _EVENTS = [EventPolicyDeviceAPI]
+    _EVENTS = [EventPolicyDeviceAPI, EventNetconfMetrics]
 
     def __init__(self, *args, **kwargs):
         super(NetconfController, self).__init__(*args, **kwargs)
@@ -18,15 +62,47 @@ class NetconfController(app_manager.RyuApp):
         # Silent ncclient info logs
         logging.getLogger('ncclient').setLevel(logging.WARNING)
 
+        # ncclient is blocking, so all NETCONF I/O runs in native worker threads, outside the Ryu event loop.
+        # Each device is discovered in a worker, Ryu threads only wait for results (see WorkerPool)
+        self.workers = WorkerPool(DISCOVERY_WORKERS, 'netconf')
+        self.discoveries = {} # {device: future} of discoveries still running
+
+        # Configuration pushes run in their own workers, so a push never waits for discoveries or the other way around
+        self.push_workers = WorkerPool(PUSH_WORKERS, 'netconf-push')
+        self.pushes = {} # {device: future} of the last push of every device
+        self.topology = None # Last topology returned by discover_all
+        self.versions = None # {hostname: version} of devices in self.topology
+
+        self.state = StateStore(STATE_PATH)
+
+        self.metrics = RpcMetrics() # Latency of NETCONF calls, per device and operation
+        self.metrics_time = 0 # Time metrics were last sent
+
+        self.inventory = Inventory(INVENTORY_PATH)
+
         self.read_config()
 
-    # Load NETCONF credentials and IP addresses from config/netconf.txt
+    def start(self):
+        super(NetconfController, self).start()
+
+        self.drift_task = hub.spawn(self.check_drift)
+
+    def stop(self):
+        self.workers.shutdown()
+        self.push_workers.shutdown()
+
+        super(NetconfController, self).stop()
+
+    # Load NETCONF credentials from config/netconf.txt, and devices from the inventory.
+    # Devices listed in config/netconf.txt are imported into a new inventory, later changes are made from the API
     def read_config(self):
-        self.devices = []
+        self.devices = {} # {hostname: Device}
+        imported = []
 
         line_count = 0
         self.nc_user = ''
         self.nc_password = ''
+        self.notifications = NOTIFICATIONS
 
         with open('config/netconf.txt', 'r') as file:
             for line in file.read().splitlines():
@@ -39,23 +115,65 @@ class NetconfController(app_manager.RyuApp):
                 elif line_count == 1:
                     self.nc_password = line.split('=')[1].strip()
                     line_count += 1
+                elif '=' in line: # Optional settings, after the credentials
+                    (key, value) = [part.strip() for part in line.split('=', 1)]
+
+                    if key == 'notifications' and value in ('true', 'false'):
+                        self.notifications = value == 'true'
+                    else:
+                        self.logger.error(f'Invalid setting: {line}')
                 else:
                     split = line.split(' ')
                     address = split[0]
                     host = split[1]
                     if re.match(r'^(?:(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\.){3}(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)$', address): # Regex for IPv4 address
-                        self.devices.append(Device(address, host, self.nc_user, self.nc_password))
+                        imported.append({'name': host, 'ip': address})
                     else:
                         self.logger.error(f'Invalid device configuration: {line}')
+
+        if self.inventory.new and len(imported) > 0:
+            self.inventory.add_all(imported)
+            self.logger.info(f'Imported {len(imported)} devices from config/netconf.txt to {INVENTORY_PATH}')
+
+        for record in self.inventory:
+            self.add_device(record['name'], record['ip'])
+
+    def add_device(self, name, ip):
+        self.devices[name] = Device(ip, name, self.nc_user, self.nc_password, state=self.state, metrics=self.metrics, notifications=self.notifications)
     
-    # Runs discovery on all devices
+    # Runs discovery on all devices concurrently.
+    # Waits at most DISCOVERY_DEADLINE seconds, devices that didn't answer in time keep running in the background,
+    # and are reported with their last discovered state. A device is never discovered twice at the same time.
+    # The topology is only rebuilt when the version of a reported device changed, see self.versions
     def discover_all(self):
         all_interfaces = {}
         all_neighbors = {}
 
-        for device in self.devices:
-            device.discover()
+        for device in self.devices.values():
+            if device not in self.discoveries:
+                self.discoveries[device] = self.workers.submit(device.discover)
 
+        # Other Ryu threads keep running while devices answer
+        self.workers.wait(list(self.discoveries.values()), DISCOVERY_DEADLINE)
+
+        for (device, future) in list(self.discoveries.items()):
+            if future.done():
+                self.discoveries.pop(device)
+
+                if future.exception():
+                    self.logger.error(f'Discovery failed on {device.ip_address} ({device.hostname}): {str(future.exception())}')
+            elif self.devices.get(device.hostname) is not device: # Device deleted while being discovered
+                self.discoveries.pop(device)
+            else:
+                self.logger.debug(f'Discovery on {device.ip_address} ({device.hostname}) missed the deadline')
+
+        versions = {device.hostname: device.version for device in self.devices.values() if device.manager}
+
+        # Nothing changed since the last cycle, return the same topology
+        if versions == self.versions:
+            return self.topology
+
+        for device in self.devices.values():
             if device.manager and device.lldp:
                 all_interfaces[device.hostname] = device.interfaces
                 all_neighbors[device.hostname] = device.neighbors
@@ -63,126 +181,456 @@ class NetconfController(app_manager.RyuApp):
                 all_interfaces[device.hostname] = ['LLDP disabled']
                 all_neighbors[device.hostname] = ['LLDP disabled']
 
-        return {'interfaces': all_interfaces, 'neighbors': all_neighbors}
+        self.topology = {'interfaces': all_interfaces, 'neighbors': all_neighbors}
+        self.versions = versions
+
+        return self.topology
 
     @set_ev_cls(RequestNetconfDiscovery)
     def request_enable_lldp(self, req):
-        self.reply_to_request(req, ReplyNetconfDiscovery(self.discover_all()))
+        start = time.perf_counter()
+        topology = self.discover_all()
+        self.metrics.record('controller', 'discover_all', time.perf_counter() - start)
+
+        self.reply_to_request(req, ReplyNetconfDiscovery(topology, self.versions))
 
-    # Configure NETCONF device with received configurations
+        if time.time() - self.metrics_time >= METRICS_INTERVAL:
+            self.metrics_time = time.time()
+            self.send_event_to_observers(EventNetconfMetrics(self.metrics.to_dict()))
+
+    # Configure NETCONF devices with received configurations.
+    # Devices are pushed concurrently (up to PUSH_WORKERS), the most urgent first (see Device.set_desired),
+    # so a network-wide change takes as long as the slowest device instead of the sum of all devices
     @set_ev_cls(EventNetconfConfigurations)
     def configure_devices(self, ev):
         configurations = ev.configurations
+        jobs = []
 
         for device_name in configurations:
-            device = next((d for d in self.devices if d.hostname == device_name), None)
+            device = self.devices.get(device_name)
+
+            # Disconnected devices keep the configurations, and apply them after connecting
+            if device:
+                priority = device.set_desired(configurations[device_name])
+
+                if priority is not None:
+                    jobs.append((priority, device))
+
+        futures = {}
+
+        for (priority, device) in sorted(jobs, key=lambda job: job[0]):
+            future = self.pushes.get(device)
+
+            # A push that didn't start yet applies the new configurations anyway
+            if future is not None and not future.running() and not future.done():
+                continue
+
+            futures[device] = self.pushes[device] = self.push_workers.submit(self.push, device)
 
-            if device and device.manager:
-                device.configure_list(configurations[device_name])
+        if len(futures) > 0:
+            hub.spawn(self.report_pushes, futures, time.perf_counter())
+
+    # Push desired configurations of device, retrying while operations fail. Runs in a push worker.
+    # Returns (seconds, operations, failed operations)
+    def push(self, device):
+        start = time.perf_counter()
+        results = device.push()
+        operations = len(results)
+
+        for retry in range(PUSH_RETRIES):
+            failed = [conf for (conf, deconf, success) in results if not success]
+
+            if len(failed) == 0:
+                break
+
+            delay = PUSH_RETRY_DELAY * 2 ** retry
+            self.logger.warning(f'Failed to configure {failed} on {device.ip_address} ({device.hostname}), retrying in {delay} seconds')
+
+            time.sleep(delay)
+            results = device.push()
+
+        failed = sum(1 for (conf, deconf, success) in results if not success)
+        seconds = time.perf_counter() - start
+
+        self.metrics.record(device.hostname, 'push', seconds, error=(failed > 0))
+        self.logger.info(f'Configured {device.ip_address} ({device.hostname}): {operations} operations in {seconds:.2f} seconds, {failed} failed')
+
+        return (seconds, operations, failed)
+
+    # Wait for pushes started together, and report how long the whole change took
+    def report_pushes(self, futures, start):
+        self.push_workers.wait(list(futures.values()))
+
+        for (device, future) in futures.items():
+            if future.exception():
+                self.logger.error(f'Push failed on {device.ip_address} ({device.hostname}): {str(future.exception())}')
+
+        results = {device: future.result() for (device, future) in futures.items() if not future.exception()}
+        failed = [device.hostname for (device, (seconds, operations, failures)) in results.items() if failures > 0]
+
+        if len(results) > 0:
+            slowest = max(results, key=lambda device: results[device][0])
+            self.logger.info(f'Configured {len(futures)} devices in {time.perf_counter() - start:.2f} seconds, slowest {slowest.hostname} ({results[slowest][0]:.2f} seconds), failed: {failed}')
     
+    # Check running configuration of devices for drift from the configuration model, one subtree of one device at a time,
+    # rotating over all connected devices and subtrees. Waits after every check, so at most DRIFT_RPC_BUDGET RPCs per second are used
+    def check_drift(self):
+        position = 0
+
+        while True:
+            checks = [(device, subtree) for device in self.devices.values() if device.manager for subtree in DRIFT_SUBTREES]
+
+            if len(checks) == 0:
+                hub.sleep(1)
+                continue
+
+            (device, subtree) = checks[position % len(checks)]
+            position += 1
+
+            future = self.workers.submit(device.check_drift, subtree)
+            self.workers.wait([future])
+
+            if future.exception():
+                self.logger.error(f'Drift check failed on {device.ip_address} ({device.hostname}): {str(future.exception())}')
+
+            rpcs = future.result() if not future.exception() else 1
+
+            hub.sleep(max(rpcs, 1) / DRIFT_RPC_BUDGET)
+
     # Run device instruction from API
     @set_ev_cls(EventClassicDeviceAPI)
     def process_device_api(self, ev):
         words = ev.words
 
+        # One or more devices: new NAME IP [NAME IP ...]
         if words[0] == 'new':
-            name = words[1]
-            ip = words[2]
+            records = [{'name': name, 'ip': ip} for (name, ip) in zip(words[1::2], words[2::2])]
 
-            self.devices.append(Device(ip, name, self.nc_user, self.nc_password))
+            added = self.inventory.add_all(records)
 
-            lines = []
+            for record in added:
+                self.add_device(record['name'], record['ip'])
 
-            with open('config/netconf.txt', 'a') as file:
-                file.write(f'{ip} {name}\n')
+            self.logger.info(f'Added {len(added)} classic devices')
 
         elif words[0] == 'edit':
             separator = words.index('old')
             new_name = ' '.join(words[1:separator])
             old_name = ' '.join(words[separator+1:])
 
-            device = next((d for d in self.devices if d.hostname == old_name), None)
+            device = self.devices.pop(old_name)
+            self.devices[new_name] = device
 
             device.hostname = new_name
-
-            lines = []
-
-            with open('config/netconf.txt', 'r') as file:
-                for line in file.readlines():
-                    if line.strip() == f'{device.ip_address} {old_name}':
-                        lines.append(f'{device.ip_address} {new_name}\n')
-                    else:
-                        lines.append(line)
-            
-            with open('config/netconf.txt', 'w') as file:
-                file.writelines(lines)
+            device.warm = False # ACL and route-map names include the hostname, so reconcile with the device instead
+            self.metrics.remove(old_name)
+            self.inventory.rename(old_name, new_name)
 
             self.send_event_to_observers(EventPolicyDeviceAPI(old_name, new_name))
             
         elif words[0] == 'delete':
-            device = next((d for d in self.devices if d.hostname == words[1]))
-            name = device.hostname
-            ip = device.ip_address
+            device = self.devices.pop(words[1])
 
-            self.devices.remove(device)
+            self.metrics.remove(device.hostname)
+            self.inventory.remove(device.hostname)
 
-            lines = []
+            # Closing the session and writing the state store block, so they run in a worker
+            self.workers.submit(self.remove_device, device)
 
-            with open('config/netconf.txt', 'r') as file:
-                for line in file.readlines():
-                    if line.strip() != f'{ip} {name}':
-                        lines.append(line)
-            
-            with open('config/netconf.txt', 'w') as file:
-                file.writelines(lines)
+    # Close session of a deleted device and forget its state. Runs in a worker
+    def remove_device(self, device):
+        device.close()
+        self.state.remove(device.ip_address)
 
 
 class Device:
-    def __init__(self, ip_address, hostname, user, password):
+    def __init__(self, ip_address, hostname, user, password, timeout=DEVICE_TIMEOUT, state=None, port=830, metrics=None, notifications=NOTIFICATIONS):
         self.ip_address = ip_address
+        self.port = port # NETCONF SSH port
         self.hostname = hostname # Hostname of device
         self.user = user # NETCONF username
         self.password = password # NETCONF password
+        self.timeout = timeout # NETCONF connect and RPC timeout
         self.manager = None # NETCONF manager (ncclient)
+        self.connect_failures = 0 # Consecutive failed connection attempts
+        self.next_connect = 0 # Earliest time of the next connection attempt
+        self.rpc_failures = 0 # Consecutive failed discoveries on the current session
         self.lldp = False # LLDP enabled or disabled
+        self.split_filters = False # Use one get per tree in discovery, set after a combined get fails
+        self.notifications = notifications # Subscribe to notifications after connecting, see subscribe
+        self.subscription = None # Subscription of the current session: 'yang-push', 'netconf' or None (polling)
+        self.poll_time = 0 # Time of the last successful neighbors poll
         self.interfaces = [] # [{'interface_name': 'Gi2', 'hw_addr': 'aa:aa:aa:aa:aa:aa'}]
         self.neighbors = {} # {neighbor_name: interface_name, ...}
+        self.version = 0 # Incremented every time interfaces or neighbors change
+        self.replies_fingerprint = None # Fingerprint of the last processed discovery replies
+        self.operational = OperationalCache(OPERATIONAL_TTL) # Operational state read by discovery
 
-        self.configurations = [] # List of applied device configurations
+        self.configurations = ConfigurationStore() # Applied device configurations
+        self.desired = None # Desired device configurations, last received from the generator
         self.acl_statements = 0 # Number of ACL statements
         self.seq_ids = {} # Map block configurations to sequence IDs
         self.route_map_statements = 0 # Number of route-map statements
         self.route_map_ids = {} # Map route-map configurations to IDs
         self.disabled = [] # List of disabled interfaces
         self.last_id = 0 # Last used ID for route-map or ACL
+        self.acl_bindings = set() # Interfaces with the ACL applied
+        self.route_map_bindings = set() # Interfaces with the route-map applied
+        self.bindings_time = 0 # Time bindings were last read from the device
+        self.batch = False # Set while configure_batch is running, edits are committed together at the end
+        self.state = state # StateStore the device state is checkpointed to, None to keep it only in memory
+        self.warm = False # Set while state restored from a snapshot is trusted for the next connection
+        self.metrics = metrics # RpcMetrics NETCONF calls are recorded in, None to not record them
 
         self.logger = logging.getLogger(f'NetconfController-{self.ip_address}')
         self.logger.setLevel(logging.INFO)
 
+        # Serializes discovery (worker thread) and configuration (Ryu thread) on this device
+        self.lock = threading.Lock()
+
+        self.restore_snapshot()
+
     # Perform topology discovery on this device
     def discover(self):
-        if self.manager is None: # NETCONF connection not established
-            self.connect()
-        elif not self.lldp: # LLDP disabled
-            self.enable_lldp()
-        else: # LLDP enabled, discover neighbors
-            self.get_neighbors()
+        with self.lock:
+            if self.manager is not None and not self.manager.connected: # Session closed by device or transport
+                self.disconnect()
+
+            if self.manager is None: # NETCONF connection not established
+                if time.time() >= self.next_connect:
+                    self.connect()
+            elif not self.lldp: # LLDP disabled
+                self.enable_lldp()
+            elif self.changed() or self.subscription is None: # LLDP enabled, discover neighbors. Notifications are drained even while polling
+                self.get_neighbors()
 
     # Configure list of configurations. Deconfigure old and configure new.
-    def configure_list(self, confs):
-        self.logger.debug(f'Configuring device {self.hostname} with [NEW] {confs}. [OLD] {self.configurations}.')
+    # In batch mode all operations are applied in one transaction (see configure_batch),
+    # otherwise each operation is committed on its own.
+    # Returns [(conf, deconf, success), ...], empty if the device is not connected
+    def configure_list(self, confs, batch=True):
+        self.set_desired(confs)
+
+        return self.push(batch)
 
-        for conf in self.configurations:
-            if conf not in confs:
-                self.configure(conf, deconf=True)
+    # Set desired configurations, without waiting for a running discovery or push.
+    # Returns priority of pushing them, lower is more urgent: 0 for removals, then by the first kind in CONFIGURATION_ORDER added.
+    # None if they're unchanged and already applied
+    def set_desired(self, confs):
+        desired = [self.canonical(conf) for conf in confs]
+        (removed, added) = self.configurations.diff(desired)
 
-        for conf in confs:
-            self.configure(conf)
+        unchanged = desired == self.desired
+        self.desired = desired
 
-    # Configure/deconfigure device with received configuration
-    def configure(self, conf, deconf=False):
+        if len(removed) > 0:
+            return 0
+        elif len(added) > 0:
+            return 1 + min(configuration_order(conf) for conf in added)
+
+        return None if unchanged else 2 + len(CONFIGURATION_ORDER)
+
+    # Apply desired configurations, if connected, and save them
+    def push(self, batch=True):
+        with self.lock:
+            results = self.apply_desired(batch) if self.manager is not None else [] # Applied after connecting
+
+            self.checkpoint()
+
+            return results
+
+    # Deconfigure applied configurations that are not desired, and configure desired ones that are not applied.
+    # A desired configuration replacing an applied one on the same device entry (e.g. new next hop of a route) modifies it in place
+    def apply_desired(self, batch=True):
+        self.logger.debug(f'Configuring device {self.hostname} with [NEW] {self.desired}. [OLD] {self.configurations}.')
+
+        (removed, added) = self.configurations.diff(self.desired)
+        (removed, added, modified) = self.pair_modifications(removed, added)
+
+        # Operations are (conf, deconf, old), old is the configuration conf replaces in place, or None.
+        # Modifications go before additions of the same kind, so an added route with the same prefix merges into the modified one
+        operations = [(conf, True, None) for conf in sorted(removed, key=configuration_order, reverse=True)]
+        operations += sorted(modified + [(conf, False, None) for conf in added], key=lambda operation: configuration_order(operation[0]))
+
+        # Configuration changes bindings and interfaces without a notification, so poll and process replies on next discovery
+        self.poll_time = 0
+        self.replies_fingerprint = None
+
+        if batch:
+            return self.configure_batch(operations)
+
+        return [(conf, deconf, self.configure(conf, deconf=deconf, old=old)) for (conf, deconf, old) in operations]
+
+    # Pair removed and added configurations of the same device entry (see entry_identity).
+    # Returns (removed, added, modified), without the paired configurations in removed and added.
+    # modified is [(conf, False, old), ...], in the same form as apply_desired operations
+    def pair_modifications(self, removed, added):
+        replaceable = {} # {identity: [old, ...]}
+
+        for conf in removed:
+            identity = self.entry_identity(conf)
+
+            if identity is not None:
+                replaceable.setdefault(identity, []).append(conf)
+
+        modified = []
+        remaining = []
+
+        for conf in added:
+            olds = replaceable.get(self.entry_identity(conf))
+
+            if olds:
+                modified.append((conf, False, olds.pop(0)))
+            else:
+                remaining.append(conf)
+
+        paired = {old for (conf, deconf, old) in modified}
+
+        return ([conf for conf in removed if conf not in paired], remaining, modified)
+
+    # Device entry configuration is applied to. Configurations with the same identity replace each other in place:
+    # static route of a prefix, route-map entry (and its ACL) of a flow, and ACL sequence of a block (any, blocks are unordered).
+    # None for configurations that are deconfigured and configured again
+    def entry_identity(self, conf):
+        split = conf.split(' ')
+
+        try:
+            if split[0] == 'route' and len(split) == 4:
+                (address, prefix) = split[1].split('/')
+                return ('route', self.get_network_address(address, prefix), prefix)
+            elif split[0] == 'route-f' and len(split) == 7:
+                return ('route-f', *split[1:6])
+            elif split[0] == 'block' and len(split) == 6:
+                return ('block',)
+        except ValueError: # Invalid configuration, fails in configure
+            pass
+
+        return None
+
+    # Apply operations as a single transaction: every edit goes to the locked candidate datastore,
+    # followed by one commit. If any operation or the commit fails, the candidate is discarded
+    # and device state is restored, so the device is left as it was before the batch.
+    # Returns [(conf, deconf, success), ...], where success is False for every operation of a failed batch
+    def configure_batch(self, operations):
+        if len(operations) == 0:
+            return []
+
+        state = self.save_state()
+        results = []
+
+        self.batch = True
+
+        try:
+            with self.manager.locked('candidate'):
+                try:
+                    for (conf, deconf, old) in operations:
+                        results.append((conf, deconf, self.configure(conf, deconf=deconf, old=old)))
+
+                    failed = [conf for (conf, _, success) in results if not success]
+
+                    if len(failed) > 0:
+                        raise Exception(f'{len(failed)} operations failed: {failed}')
+
+                    self.manager.commit()
+                except Exception:
+                    self.manager.discard_changes()
+                    raise
+
+            self.logger.debug(f'Committed {len(operations)} operations on {self.ip_address} ({self.hostname})')
+
+            return results
+        except Exception as e:
+            self.restore_state(state)
+
+            self.logger.error(f'Rolled back {len(operations)} operations on {self.ip_address} ({self.hostname}): {str(e)}')
+
+            return [(conf, deconf, False) for (conf, deconf, old) in operations]
+        finally:
+            self.batch = False
+
+    # Copy of the device state changed by configuration operations
+    def save_state(self):
+        return {
+            'configurations': self.configurations.copy(),
+            'acl_statements': self.acl_statements,
+            'seq_ids': dict(self.seq_ids),
+            'route_map_statements': self.route_map_statements,
+            'route_map_ids': dict(self.route_map_ids),
+            'disabled': list(self.disabled),
+            'last_id': self.last_id
+        }
+
+    # Restore device state saved by save_state
+    def restore_state(self, state):
+        self.configurations = state['configurations']
+        self.acl_statements = state['acl_statements']
+        self.seq_ids = state['seq_ids']
+        self.route_map_statements = state['route_map_statements']
+        self.route_map_ids = state['route_map_ids']
+        self.disabled = state['disabled']
+        self.last_id = state['last_id']
+
+    # JSON-serializable device state, written to the snapshot log
+    def snapshot(self):
+        return {
+            'hostname': self.hostname,
+            'configurations': list(self.configurations),
+            'desired': list(self.desired) if self.desired is not None else None,
+            'acl_statements': self.acl_statements,
+            'seq_ids': dict(self.seq_ids),
+            'route_map_statements': self.route_map_statements,
+            'route_map_ids': dict(self.route_map_ids),
+            'disabled': list(self.disabled),
+            'last_id': self.last_id
+        }
+
+    # Write device state to the snapshot log
+    def checkpoint(self):
+        if self.state is None:
+            return
+
+        try:
+            self.state.put(self.ip_address, self.snapshot())
+        except Exception as e:
+            self.logger.error(f'Failed to save state of {self.ip_address} ({self.hostname}): {str(e)}')
+
+    # Restore device state from the snapshot log (warm restart).
+    # The restored configurations are trusted on the first connection, so nothing is read back or pushed again,
+    # and ACL sequence numbers and route-map IDs stay the same as before the restart
+    def restore_snapshot(self):
+        snapshot = self.state.get(self.ip_address) if self.state is not None else None
+
+        if snapshot is None or snapshot['hostname'] != self.hostname:
+            return
+
+        self.restore_state({
+            'configurations': ConfigurationStore(snapshot['configurations']),
+            'acl_statements': snapshot['acl_statements'],
+            'seq_ids': dict(snapshot['seq_ids']),
+            'route_map_statements': snapshot['route_map_statements'],
+            'route_map_ids': dict(snapshot['route_map_ids']),
+            'disabled': list(snapshot['disabled']),
+            'last_id': snapshot['last_id']
+        })
+        self.desired = list(snapshot['desired']) if snapshot['desired'] is not None else None
+        self.warm = True
+
+        self.logger.debug(f'Restored state of {self.ip_address} ({self.hostname}): {self.configurations}')
+
+    # Edit candidate configuration, and commit it unless a batch is being applied
+    def edit(self, config):
+        self.manager.edit_config(config=config)
+
+        if not self.batch:
+            self.manager.commit()
+
+    # Configure/deconfigure device with received configuration, or replace applied configuration old with it. Returns True if applied
+    def configure(self, conf, deconf=False, old=None):
         if not deconf and conf in self.configurations:
-            return # Configuration already applied
+            return True # Configuration already applied
+
+        if old is not None:
+            return self.modify(conf, old)
 
         split = conf.split(' ')
 
@@ -194,7 +642,9 @@ class Device:
                 if deconf:
                     self.configurations.remove(conf)
                 else:
-                    self.configurations.append(conf)
+                    self.configurations.add(conf)
+
+                return True
 
         elif split[0] == 'route':
             (address, prefix) = split[1].split('/')
@@ -203,11 +653,17 @@ class Device:
             interface = split[2]
             next_hop = split[3]
 
+            # Other next hops of the prefix stay, the last route of the prefix deletes it whole
+            if deconf and not any(other != conf for other in self.configurations.by_prefix(destination, prefix)):
+                (interface, next_hop) = (None, None)
+
             if self.configure_route(destination, prefix, interface, next_hop, deconf=deconf):
                 if deconf:
                     self.configurations.remove(conf)
                 else:
-                    self.configurations.append(conf)
+                    self.configurations.add(conf)
+
+                return True
 
         elif split[0] == 'block':
             (src_ip, dst_ip, proto, src_port, dst_port) = split[1:]
@@ -216,7 +672,9 @@ class Device:
                 if deconf:
                     self.configurations.remove(conf)
                 else:
-                    self.configurations.append(conf)
+                    self.configurations.add(conf)
+
+                return True
         
         elif split[0] == 'route-f':
             (src_ip, dst_ip, proto, src_port, dst_port, port) = split[1:]
@@ -225,7 +683,9 @@ class Device:
                 if deconf:
                     self.configurations.remove(conf)
                 else:
-                    self.configurations.append(conf)
+                    self.configurations.add(conf)
+
+                return True
         
         elif split[0] == 'disable':
             port = split[1]
@@ -234,35 +694,607 @@ class Device:
                 if deconf:
                     self.configurations.remove(conf)
                 else:
-                    self.configurations.append(conf)
+                    self.configurations.add(conf)
+
+                return True
 
         else:
             self.logger.error(f'Invalid configuration for device {self.hostname}: {conf}')
 
+        return False
+
+    # Replace applied configuration old with conf, on the same device entry (see entry_identity), with a single edit.
+    # Returns True if applied
+    def modify(self, conf, old):
+        split = conf.split(' ')
+        old_key = '_'.join(old.split(' ')[1:])
+        key = '_'.join(split[1:])
+
+        if split[0] == 'route':
+            (address, prefix) = split[1].split('/')
+            destination = self.get_network_address(address, prefix)
+
+            # Only the paired next hop is replaced, other next hops of the prefix stay
+            success = self.configure_route(destination, prefix, split[2], split[3], old=tuple(old.split(' ')[2:4]))
+
+        elif split[0] == 'route-f':
+            id = self.route_map_ids[old_key]
+
+            # Same flow, so only the next hop of the route-map entry changes, its ACL stays
+            success = self.configure_route_map(*split[1:7], id=id, replace=True)
+
+            if success:
+                self.route_map_ids.pop(old_key)
+                self.route_map_ids[key] = id
+
+        elif split[0] == 'block':
+            sequence_id = self.seq_ids[old_key]
+
+            success = self.configure_acl(f'ACL_{self.hostname}', sequence_id, split[1:6], replace=True)
+
+            if success:
+                self.seq_ids.pop(old_key)
+                self.seq_ids[key] = sequence_id
+
+        if success:
+            self.configurations.remove(old)
+            self.configurations.add(conf)
+
+            self.logger.debug(f'Modified {old} to {conf} on {self.ip_address} ({self.hostname})')
+
+        return success
+
     # Establish NETCONF connection with device
     def connect(self):
+        start = time.perf_counter()
+
         try:
             self.manager = manager.connect(
                 host=self.ip_address,
-                port=830,
+                port=self.port,
                 username=self.user,
                 password=self.password,
                 hostkey_verify=False,
-                timeout=10
+                timeout=self.timeout
             )
+
+            if self.metrics is not None:
+                self.metrics.record(self.hostname, 'connect', time.perf_counter() - start)
+                self.manager = InstrumentedManager(self.manager, self.metrics, self)
+
+            self.manager.timeout = self.timeout # Timeout for each RPC
+            self.connect_failures = 0
+            self.rpc_failures = 0
+            self.bindings_time = 0 # Bindings are unknown on a new session
+            self.subscription = None
+            self.poll_time = 0
+            self.replies_fingerprint = None
+            self.operational.invalidate()
             self.logger.debug(f'Established NETCONF connection with {self.ip_address} ({self.hostname})')
             self.load_configurations()
+
+            if self.desired is not None:
+                self.apply_desired()
+
+            self.checkpoint()
+
+            if self.notifications:
+                self.subscribe()
+
             self.enable_lldp()
         except Exception as e:
+            if self.metrics is not None and self.manager is None:
+                self.metrics.record(self.hostname, 'connect', time.perf_counter() - start, error=True)
+
+            # Retry after an exponential backoff with jitter, so unreachable devices cost almost nothing,
+            # and many devices failing together don't retry at the same time
+            self.connect_failures += 1
+            backoff = min(RECONNECT_BACKOFF_MAX, RECONNECT_BACKOFF * 2 ** (self.connect_failures - 1))
+            self.next_connect = time.time() + random.uniform(backoff / 2, backoff)
+
             # Use debug instead of error, as it's expected that some devices will be unreachable (e.g. shutdown)
-            self.logger.debug(f'Failed to establish NETCONF connection with {self.ip_address} ({self.hostname}): {str(e)}')
+            self.logger.debug(f'Failed to establish NETCONF connection with {self.ip_address} ({self.hostname}), retrying in {self.next_connect - time.time():.1f} seconds: {str(e)}')
+
+    # Subscribe to on-change notifications for LLDP and interface state.
+    # Tries YANG-push (RFC 8641) first, then falls back to the RFC 5277 NETCONF stream, where any notification
+    # (e.g. config change, link up/down) triggers a poll. Devices supporting neither keep being polled every cycle
+    def subscribe(self):
+        xpaths = ['/oc-lldp:lldp/oc-lldp:interfaces', '/oc-if:interfaces/oc-if:interface/oc-if:state']
+        established = [] # IDs of YANG-push subscriptions, deleted if a later one fails
+
+        try:
+            for xpath in xpaths:
+                reply = self.manager.dispatch(to_ele(f'''
+                    <establish-subscription xmlns="urn:ietf:params:xml:ns:yang:ietf-subscribed-notifications"
+                                            xmlns:yp="urn:ietf:params:xml:ns:yang:ietf-yang-push">
+                        <yp:datastore xmlns:ds="urn:ietf:params:xml:ns:yang:ietf-datastores">ds:operational</yp:datastore>
+                        <yp:datastore-xpath-filter xmlns:oc-lldp="http://openconfig.net/yang/lldp"
+                                                   xmlns:oc-if="http://openconfig.net/yang/interfaces">{xpath}</yp:datastore-xpath-filter>
+                        <yp:on-change>
+                            <yp:dampening-period>0</yp:dampening-period>
+                        </yp:on-change>
+                    </establish-subscription>
+                '''))
+
+                established.append(to_ele(reply.xml).findtext('.//{urn:ietf:params:xml:ns:yang:ietf-subscribed-notifications}id'))
+
+            self.subscription = 'yang-push'
+        except Exception as e:
+            self.logger.debug(f'YANG-push subscription failed on {self.ip_address} ({self.hostname}): {str(e)}')
+
+            # Otherwise the device streams the same changes on these and on the NETCONF stream
+            if not self.unsubscribe(established):
+                return
+
+            try:
+                self.manager.create_subscription()
+                self.subscription = 'netconf'
+            except Exception as e:
+                self.logger.debug(f'NETCONF stream subscription failed on {self.ip_address} ({self.hostname}), polling instead: {str(e)}')
+                return
+
+        self.logger.debug(f'Subscribed to {self.subscription} notifications on {self.ip_address} ({self.hostname})')
+
+    # Delete YANG-push subscriptions. Returns False if any is left, the device is then polled, see discover
+    def unsubscribe(self, ids):
+        for id in ids:
+            try:
+                self.manager.dispatch(to_ele(f'''
+                    <delete-subscription xmlns="urn:ietf:params:xml:ns:yang:ietf-subscribed-notifications">
+                        <id>{id}</id>
+                    </delete-subscription>
+                '''))
+            except Exception as e:
+                self.logger.warning(f'Failed to delete subscription {id} on {self.ip_address} ({self.hostname}), polling instead: {str(e)}')
+                return False
+
+        return True
+
+    # Drain received notifications. Returns True if any was received, or the safety poll is due
+    def changed(self):
+        notified = False
+
+        while self.manager.take_notification(block=False) is not None:
+            notified = True
+
+        return notified or time.time() - self.poll_time >= SAFETY_POLL_INTERVAL
+
+    # Close NETCONF session of a deleted device, waiting for a running discovery or push
+    def close(self):
+        with self.lock:
+            if self.manager is not None:
+                self.disconnect()
+
+    # Close NETCONF session, if the device still answers, and forget it
+    def disconnect(self):
+        try:
+            if self.manager.connected:
+                self.manager.timeout = PROBE_TIMEOUT
+                self.manager.close_session()
+        except Exception:
+            pass
+
+        self.manager = None
+        self.rpc_failures = 0
+
+        self.logger.debug(f'Disconnected from {self.ip_address} ({self.hostname})')
+
+    # Handle a failed discovery RPC. The session is kept if the device still answers
+    # (rpc-error reply or passing liveness probe), unless it failed MAX_RPC_FAILURES times in a row
+    def rpc_failed(self, error):
+        self.rpc_failures += 1
+
+        if self.rpc_failures >= MAX_RPC_FAILURES or not (isinstance(error, RPCError) or self.is_alive()):
+            self.disconnect()
+
+    # Cheap liveness probe: transport state first, then a small get with a short timeout
+    def is_alive(self):
+        if not self.manager.connected:
+            return False
+
+        filter = '''
+                    <filter xmlns="urn:ietf:params:xml:ns:netconf:base:1.0">
+                        <lldp xmlns="http://openconfig.net/yang/lldp">
+                            <config>
+                                <enabled></enabled>
+                            </config>
+                        </lldp>
+                    </filter>
+                '''
+
+        try:
+            self.manager.timeout = PROBE_TIMEOUT
+            self.manager.get(filter)
+            return True
+        except RPCError:
+            return True # Device answered, even if with an error
+        except Exception:
+            return False
+        finally:
+            self.manager.timeout = self.timeout
     
-    # Load device configurations
+    # Load configurations applied on the device into the configuration model (reconcile-on-connect),
+    # so only the difference to the desired configurations is pushed, instead of deleting and pushing everything again.
+    # Configurations that can't be expressed in the model (e.g. ACLs and route-maps not created by this controller) are deleted.
+    # Falls back to deleting all routes, ACLs and route-maps if the running configuration can't be read.
+    # Skipped on the first connection after a warm restart (see restore_snapshot)
     def load_configurations(self):
-        self.deconfigure_routes()
-        self.deconfigure_acls()
-        self.deconfigre_route_map()
-        self.load_configured_addresses()
+        if self.warm: # State restored from snapshot, already matches the device
+            self.warm = False
+            return
+
+        self.configurations = ConfigurationStore()
+        self.acl_statements = 0
+        self.seq_ids = {}
+        self.route_map_statements = 0
+        self.route_map_ids = {}
+        self.disabled = []
+        self.last_id = 0
+
+        try:
+            reply = self.manager.get_config(source='running', filter=self.running_config_filter()).data_ele
+        except Exception as e:
+            self.logger.error(f'Failed to read running configuration on {self.ip_address} ({self.hostname}), deleting it instead: {str(e)}')
+
+            self.deconfigure_routes()
+            self.deconfigure_acls()
+            self.deconfigre_route_map()
+            self.load_configured_addresses()
+            return
+
+        cleanup = [] # Edits deleting configurations the model can't express, applied in one transaction
+
+        try:
+            for (i, (interface_name, address, prefix)) in enumerate(parsers.parse_addresses(reply)):
+                # Skip management interface
+                if i > 0 and address is not None:
+                    self.configurations.add(f'address {interface_name} {address}/{prefix}')
+
+            # Disabled interfaces are loaded as disable configurations, so the ones no longer desired are
+            # deconfigured and then activated by get_neighbors, like interfaces of a new device
+            for (i, (interface_name, enabled)) in enumerate(parsers.parse_enabled(reply)):
+                if i > 0 and not enabled:
+                    self.configurations.add(f'disable {interface_name}')
+                    self.disabled.append(interface_name)
+
+            for (destination, next_hops) in parsers.parse_static_routes(reply):
+                (address, prefix) = destination.split('/')
+
+                # Routes without next hop or interface, or with an index configure_route doesn't use, aren't created by this controller
+                if len(next_hops) == 0 or any(None in (next_hop, interface) or index != f'{interface}_{next_hop}_{address}_{prefix}' for (next_hop, interface, index) in next_hops):
+                    cleanup.append(partial(self.configure_route, address, prefix, None, None, deconf=True))
+                    continue
+
+                for (next_hop, interface, index) in next_hops:
+                    self.configurations.add(f'route {destination} {interface} {next_hop}')
+
+            acls = parsers.parse_acl_entries(reply)
+            route_map_acls = set()
+
+            # Next hop address to exit port, from the /30 link addresses
+            ports = {self.get_next_hop_from_port(conf.split(' ')[1]): conf.split(' ')[1] for conf in self.configurations.by_kind('address')}
+
+            for (route_map_name, entries) in parsers.parse_route_map_entries(reply).items():
+                if route_map_name != f'MAP_{self.hostname}':
+                    cleanup.append(partial(self.deconfigure_route_map_name, route_map_name))
+                    continue
+
+                for (id, entry) in entries.items():
+                    acl_name = f'ACL_route-f_{self.hostname}_{id}'
+                    acl_entry = acls.get(acl_name, {}).get(10)
+                    port = ports.get(entry['next_hop'])
+
+                    if entry['acl'] != acl_name or acl_entry is None or port is None:
+                        cleanup.append(partial(self.deconfigure_route_map_entry, route_map_name, id))
+                        continue
+
+                    flow = self.entry_to_flow(acl_entry)
+
+                    self.configurations.add(f'route-f {" ".join(flow)} {port}')
+                    self.route_map_ids['_'.join(flow + (port,))] = id
+                    self.route_map_statements += 1
+                    self.last_id = max(self.last_id, id)
+                    route_map_acls.add(acl_name)
+
+            for (acl_name, entries) in acls.items():
+                if acl_name in route_map_acls:
+                    continue
+
+                if acl_name != f'ACL_{self.hostname}' or list(entries) == [999]:
+                    cleanup.append(partial(self.deconfigure_acl_name, acl_name))
+                    continue
+
+                for (seq, entry) in entries.items():
+                    if seq == 999: # Permit all statement, added with the first block
+                        continue
+
+                    flow = self.entry_to_flow(entry)
+
+                    if entry['action'] != 'DROP':
+                        cleanup.append(partial(self.configure_acl, acl_name, seq, flow, deconf=True))
+                        continue
+
+                    self.configurations.add(f'block {" ".join(flow)}')
+                    self.seq_ids['_'.join(flow)] = seq
+                    self.acl_statements += 1
+                    self.last_id = max(self.last_id, seq)
+
+            self.clean_up(cleanup)
+
+            self.logger.debug(f'Loaded configurations on {self.ip_address} ({self.hostname}): {self.configurations}')
+        except Exception as e:
+            self.logger.error(f'Failed to load configurations on {self.ip_address} ({self.hostname}): {str(e)}')
+
+    # Apply cleanup edits of load_configurations as one transaction on the locked candidate, like configure_batch.
+    # If any edit or the commit fails, the candidate is discarded, so no partial cleanup is left for the next commit
+    def clean_up(self, cleanup):
+        if len(cleanup) == 0:
+            return
+
+        self.batch = True
+
+        try:
+            with self.manager.locked('candidate'):
+                try:
+                    for edit in cleanup:
+                        # configure_* return False on failure, deconfigure_* raise
+                        if edit() is False:
+                            raise Exception(f'{edit.func.__name__}{edit.args} failed')
+
+                    self.manager.commit()
+                except Exception:
+                    self.manager.discard_changes()
+                    raise
+        finally:
+            self.batch = False
+
+    # Filter for running configuration subtrees in the configuration model: 'addresses' (with administrative state of interfaces),
+    # 'routes', 'acls' and 'route-maps'.
+    # All subtrees if none is given
+    def running_config_filter(self, *subtrees):
+        trees = {
+            'addresses': '''
+                        <interfaces xmlns="http://openconfig.net/yang/interfaces">
+                            <interface>
+                                <name></name>
+                                <config>
+                                    <enabled></enabled>
+                                </config>
+                                <subinterfaces>
+                                    <subinterface>
+                                        <index>0</index>
+                                        <ipv4 xmlns="http://openconfig.net/yang/interfaces/ip">
+                                            <addresses>
+                                            </addresses>
+                                        </ipv4>
+                                    </subinterface>
+                                </subinterfaces>
+                            </interface>
+                        </interfaces>
+                    ''',
+            'routes': '''
+                        <network-instances xmlns="http://openconfig.net/yang/network-instance">
+                            <network-instance>
+                                <name>default</name>
+                                <protocols>
+                                    <protocol>
+                                        <static-routes>
+                                        </static-routes>
+                                    </protocol>
+                                </protocols>
+                            </network-instance>
+                        </network-instances>
+                    ''',
+            'acls': '''
+                        <acl xmlns="http://openconfig.net/yang/acl">
+                            <acl-sets>
+                            </acl-sets>
+                        </acl>
+                    ''',
+            'route-maps': '''
+                        <native xmlns="http://cisco.com/ns/yang/Cisco-IOS-XE-native">
+                            <route-map>
+                            </route-map>
+                        </native>
+                    '''
+        }
+
+        return self.subtree_filter(*(trees[subtree] for subtree in (subtrees or trees)))
+
+    # Convert ACL entry read from device to flow (src_ip, dst_ip, proto, src_port, dst_port), reversing configure_acl.
+    # Values the device normalized differently than the policy (e.g. protocol names) don't match the desired
+    # configuration, and are replaced by the generator like any other changed configuration
+    def entry_to_flow(self, entry):
+        src_ip = '*' if entry['src_ip'] in (None, '0.0.0.0/0') else entry['src_ip']
+        dst_ip = '*' if entry['dst_ip'] in (None, '0.0.0.0/0') else entry['dst_ip']
+        src_port = '*' if entry['src_port'] in (None, 'ANY') else entry['src_port']
+        dst_port = '*' if entry['dst_port'] in (None, 'ANY') else entry['dst_port']
+
+        proto = (entry['proto'] or 'IP').split(':')[-1] # Strip identity prefix
+        proto = {'IP': '*', 'IP_TCP': '6', 'IP_UDP': '17'}.get(proto, proto)
+
+        return (src_ip, dst_ip, proto, src_port, dst_port)
+
+    # Convert configuration to the form it's read back from the device in, so both compare equal
+    def canonical(self, conf):
+        split = conf.split(' ')
+
+        # Routes are installed for the network address of the destination
+        if split[0] == 'route':
+            (address, prefix) = split[1].split('/')
+            split[1] = f'{self.get_network_address(address, prefix)}/{prefix}'
+
+        return ' '.join(split)
+
+    # Delete ACL set from device
+    def deconfigure_acl_name(self, acl_name):
+        self.edit(f'''
+                    <config xmlns="urn:ietf:params:xml:ns:netconf:base:1.0">
+                        <acl xmlns="http://openconfig.net/yang/acl">
+                            <acl-sets>
+                                <acl-set operation="delete">
+                                    <name>{acl_name}</name>
+                                    <type>ACL_IPV4</type>
+                                </acl-set>
+                            </acl-sets>
+                        </acl>
+                    </config>
+        ''')
+
+        self.logger.debug(f'Deconfigured ACL ({acl_name}) on {self.ip_address} ({self.hostname})')
+
+    # Delete route-map from device
+    def deconfigure_route_map_name(self, route_map_name):
+        self.edit(f'''
+                    <config xmlns="urn:ietf:params:xml:ns:netconf:base:1.0">
+                        <native xmlns="http://cisco.com/ns/yang/Cisco-IOS-XE-native">
+                            <route-map operation="delete">
+                                <name>{route_map_name}</name>
+                            </route-map>
+                        </native>
+                    </config>
+        ''')
+
+        self.logger.debug(f'Deconfigured route-map ({route_map_name}) on {self.ip_address} ({self.hostname})')
+
+    # Delete route-map entry from device
+    def deconfigure_route_map_entry(self, route_map_name, id):
+        self.edit(f'''
+                    <config xmlns="urn:ietf:params:xml:ns:netconf:base:1.0">
+                        <native xmlns="http://cisco.com/ns/yang/Cisco-IOS-XE-native">
+                            <route-map>
+                                <name>{route_map_name}</name>
+                                <route-map-without-order-seq xmlns="http://cisco.com/ns/yang/Cisco-IOS-XE-route-map" operation="delete">
+                                    <seq_no>{id}</seq_no>
+                                </route-map-without-order-seq>
+                            </route-map>
+                        </native>
+                    </config>
+        ''')
+
+        self.logger.debug(f'Deconfigured route-map ({route_map_name}) entry {id} on {self.ip_address} ({self.hostname})')
+
+    # Compare one subtree of the running configuration ('addresses', 'routes', 'acls' or 'route-maps') with the configuration model,
+    # and repair only the entries that differ, in one transaction. The model is not changed, it's the intended state.
+    # Returns the number of RPCs used
+    def check_drift(self, subtree):
+        with self.lock:
+            if self.manager is None:
+                return 0
+
+            try:
+                reply = self.manager.get_config(source='running', filter=self.running_config_filter(subtree)).data_ele
+            except Exception as e:
+                self.logger.debug(f'Failed to read {subtree} for drift check on {self.ip_address} ({self.hostname}): {str(e)}')
+                return 1
+
+            (intended, running) = self.drift_entries(subtree, reply)
+
+            if intended == running:
+                return 1
+
+            missing = intended - running
+            extra = running - intended
+
+            self.logger.warning(f'Configuration drift in {subtree} on {self.ip_address} ({self.hostname}), missing: {missing}, unexpected: {extra}')
+
+            self.batch = True
+
+            try:
+                with self.manager.locked('candidate'):
+                    edits = self.repair_drift(subtree, intended, missing, extra)
+                    self.manager.commit()
+
+                self.logger.info(f'Repaired {subtree} drift on {self.ip_address} ({self.hostname}) with {edits} edits')
+            except Exception as e:
+                edits = 0
+
+                try:
+                    self.manager.discard_changes()
+                except Exception:
+                    pass
+
+                self.logger.error(f'Failed to repair {subtree} drift on {self.ip_address} ({self.hostname}): {str(e)}')
+            finally:
+                self.batch = False
+
+            return edits + 4 # get-config, lock, commit and unlock
+
+    # Returns (intended, running): sets of comparable entries of subtree, from the configuration model and from the reply
+    def drift_entries(self, subtree, reply):
+        if subtree == 'addresses':
+            intended = {(conf.split(' ')[1], *conf.split(' ')[2].split('/')) for conf in self.configurations.by_kind('address')}
+            # Skip management interface
+            running = {address for (i, address) in enumerate(parsers.parse_addresses(reply)) if i > 0 and address[1] is not None}
+
+        elif subtree == 'routes':
+            intended = {tuple(conf.split(' ')[1:]) for conf in self.configurations.by_kind('route')}
+            running = {(prefix, interface, next_hop) for (prefix, next_hops) in parsers.parse_static_routes(reply) for (next_hop, interface, index) in next_hops}
+
+        elif subtree == 'acls':
+            # (acl_name, seq, action, flow)
+            intended = {(f'ACL_{self.hostname}', seq, 'DROP', tuple(key.split('_'))) for (key, seq) in self.seq_ids.items()
+                        if f'block {key.replace("_", " ")}' in self.configurations}
+            intended |= {(f'ACL_route-f_{self.hostname}_{id}', 10, 'ACCEPT', tuple(key.split('_')[:-1])) for (key, id) in self.route_map_ids.items()
+                         if f'route-f {key.replace("_", " ")}' in self.configurations}
+
+            if self.acl_statements > 0:
+                intended.add((f'ACL_{self.hostname}', 999, 'ACCEPT', ('*', '*', '*', '*', '*')))
+
+            running = {(acl_name, seq, entry['action'], self.entry_to_flow(entry)) for (acl_name, entries) in parsers.parse_acl_entries(reply).items()
+                       if acl_name == f'ACL_{self.hostname}' or acl_name.startswith(f'ACL_route-f_{self.hostname}_') for (seq, entry) in entries.items()}
+
+        elif subtree == 'route-maps':
+            # (seq, next_hop, acl_name)
+            intended = {(id, self.get_next_hop_from_port(key.split('_')[-1]), f'ACL_route-f_{self.hostname}_{id}') for (key, id) in self.route_map_ids.items()
+                        if f'route-f {key.replace("_", " ")}' in self.configurations}
+            running = {(id, entry['next_hop'], entry['acl']) for (id, entry) in parsers.parse_route_map_entries(reply).get(f'MAP_{self.hostname}', {}).items()}
+
+            # Entries whose exit port has no address have no intended next hop, so they can't be compared (or repaired)
+            unresolved = {entry[0] for entry in intended if entry[1] is None}
+
+            if len(unresolved) > 0:
+                self.logger.debug(f'Skipping route-map entries {unresolved} without next hop in drift check on {self.ip_address} ({self.hostname})')
+
+                intended = {entry for entry in intended if entry[0] not in unresolved}
+                running = {entry for entry in running if entry[0] not in unresolved}
+
+        return (intended, running)
+
+    # Delete unexpected entries, then configure missing ones. Returns the number of edits.
+    # Raises on the first failed edit, so check_drift discards the partly repaired candidate
+    def repair_drift(self, subtree, intended, missing, extra):
+        edits = []
+
+        if subtree == 'addresses':
+            edits += [partial(self.configure_address, interface, address, prefix, deconf=True) for (interface, address, prefix) in extra]
+            edits += [partial(self.configure_address, interface, address, prefix) for (interface, address, prefix) in missing]
+
+        elif subtree == 'routes':
+            # Routes are deleted by prefix, so intended routes sharing the prefix are configured again
+            prefixes = {prefix for (prefix, interface, next_hop) in extra}
+
+            edits += [partial(self.configure_route, *prefix.split('/'), None, None, deconf=True) for prefix in prefixes]
+            edits += [partial(self.configure_route, *prefix.split('/'), interface, next_hop)
+                      for (prefix, interface, next_hop) in missing | {route for route in intended if route[0] in prefixes}]
+
+        elif subtree == 'acls':
+            edits += [partial(self.configure_acl, acl_name, seq, flow, deconf=True) for (acl_name, seq, action, flow) in extra]
+            edits += [partial(self.configure_acl, acl_name, seq, flow, permit=(action == 'ACCEPT')) for (acl_name, seq, action, flow) in missing]
+
+        elif subtree == 'route-maps':
+            edits += [partial(self.deconfigure_route_map_entry, f'MAP_{self.hostname}', id) for (id, next_hop, acl_name) in extra]
+
+            ports = {id: key.split('_') for (key, id) in self.route_map_ids.items()}
+
+            edits += [partial(self.configure_route_map, *ports[id], id=id) for (id, next_hop, acl_name) in missing]
+
+        for edit in edits:
+            # configure_* return False on failure, deconfigure_* raise
+            if edit() is False:
+                raise Exception(f'{edit.func.__name__}{edit.args} failed')
+
+        return len(edits)
 
     # Enable LLDP on device
     def enable_lldp(self):
@@ -286,30 +1318,95 @@ class Device:
                     </config>
                 '''        
         try:
-            lldp_reply = ET.fromstring(self.manager.get(filter).data_xml)
+            lldp_reply = self.manager.get(filter).data_ele
 
-            if lldp_reply.find('.//{http://openconfig.net/yang/lldp}enabled').text != 'true':
-                self.manager.edit_config(config=config)
-                self.manager.commit()
+            if lldp_reply.findtext('.//{http://openconfig.net/yang/lldp}enabled') != 'true':
+                self.edit(config)
 
             self.lldp = True
+            self.version += 1 # Reported with interfaces instead of 'LLDP disabled'
             self.logger.debug(f'Enabled LLDP on {self.ip_address} ({self.hostname})')
             self.get_neighbors()
         except Exception as e:
-            # Assume any exception means device got disconnected
-            self.manager = None
             self.logger.debug(f'Failed to enable LLDP on {self.ip_address} ({self.hostname}): {str(e)}')
+            self.rpc_failed(e)
 
     # Get LLDP neighbors, and check for disabled (newly added) interfaces
+    # Replies identical to the last processed ones aren't parsed again
     def get_neighbors(self):
-        
-        # Note: Used two filters instead of one because a single filter doesn't get a respond 
-        #       from a virtual device in a different server than the server running this system.
-        #       Not sure what's the cause, but a possible theory is that the packet size is too big,
-        #       as the different servers are connected using VXLAN tunnels, which adds extra overhead to the packets.
-        
-        lldp_filter = '''
-                    <filter xmlns="urn:ietf:params:xml:ns:netconf:base:1.0">
+        try:
+            (lldp_reply, interfaces_reply, fingerprint) = self.get_discovery_replies()
+
+            if time.time() - self.bindings_time >= BINDINGS_RECONCILE_INTERVAL:
+                self.reconcile_bindings()
+
+            if fingerprint == self.replies_fingerprint:
+                self.operational.touch('interfaces')
+                self.rpc_failures = 0
+                self.poll_time = time.time()
+                return
+
+            disabled_interfaces = []
+
+            # Build new neighbors and interfaces, then swap them in at once,
+            # so discover_all never reports a half-discovered device
+            neighbors = {}
+            interfaces = []
+
+            lldp_interfaces = parsers.parse_lldp(lldp_reply)
+            oc_interfaces = parsers.parse_interfaces(interfaces_reply)
+            self.operational.put('interfaces', oc_interfaces)
+
+            for (interface_name, lldp_interface) in lldp_interfaces.items():
+                # Same interface but in openconfig-interfaces tree, instead of openconfig-lldp
+                non_lldp_interface = oc_interfaces.get(interface_name)
+
+                if non_lldp_interface is None:
+                    self.logger.debug(f'Interface {interface_name} missing from openconfig-interfaces on {self.ip_address} ({self.hostname})')
+                    continue
+
+                # Make sure ACL and route-map are applied/not applied to interface when there is (no) statements
+                self.update_bindings(interface_name)
+
+                # Add interface to interfaces
+                interfaces.append({'interface_name': interface_name, 'hw_addr': non_lldp_interface['hw_addr']})
+
+                # Check if interface is disabled or LLDP is disabled (Make sure interface is not disabled by policy first)
+                if interface_name in self.disabled:
+                    continue
+
+                if not (non_lldp_interface['enabled'] and lldp_interface['enabled']):
+                    disabled_interfaces.append(interface_name)
+                    continue
+
+                for neighbor_name in lldp_interface['neighbors']:
+                    # Add neighbor to neighbors
+                    neighbors[neighbor_name] = interface_name
+
+                self.logger.debug(f'Found {len(lldp_interface["neighbors"])} neighbors on {interface_name} {self.ip_address} ({self.hostname})')
+
+            if neighbors != self.neighbors or interfaces != self.interfaces:
+                self.neighbors = neighbors
+                self.interfaces = interfaces
+                self.version += 1
+
+            self.rpc_failures = 0
+            self.poll_time = time.time()
+
+            # Replies with disabled interfaces are processed again, until the interfaces are activated
+            self.replies_fingerprint = fingerprint if len(disabled_interfaces) == 0 else None
+
+            if len(disabled_interfaces) > 0:
+                self.logger.debug(f'Found {len(disabled_interfaces)} disabled interfaces on {self.ip_address} ({self.hostname})')
+                self.activate_interfaces(disabled_interfaces)
+        except Exception as e:
+            self.logger.debug(f'Failed to get neighbors from {self.ip_address} ({self.hostname}): {str(e)}')
+            self.rpc_failed(e)
+
+    # Get the LLDP and openconfig-interfaces trees used by discovery.
+    # Returns (lldp_reply, interfaces_reply, fingerprint). With a combined filter both replies are the same element.
+    def get_discovery_replies(self):
+        lldp_tree = '''
                         <lldp xmlns="http://openconfig.net/yang/lldp">
                             <interfaces>
                                 <interface>
@@ -327,98 +1424,124 @@ class Device:
                                 </interface>
                             </interfaces>
                         </lldp>
-                    </filter>
                     '''
-        
-        interfaces_filter = '''
-                        <filter xmlns="urn:ietf:params:xml:ns:netconf:base:1.0">
-                            <interfaces xmlns="http://openconfig.net/yang/interfaces">
-                                <interface>
-                                    <name></name>
+
+        interfaces_tree = self.interfaces_tree()
+
+        if not self.split_filters:
+            try:
+                reply = self.manager.get(self.subtree_filter(lldp_tree, interfaces_tree))
+                return (reply.data_ele, reply.data_ele, parsers.fingerprint(reply))
+            except Exception as e:
+                if not self.manager.connected:
+                    raise
+
+                # Note: A single filter doesn't get a respond from a virtual device in a different server than the server running this system.
+                #       Not sure what's the cause, but a possible theory is that the packet size is too big,
+                #       as the different servers are connected using VXLAN tunnels, which adds extra overhead to the packets.
+                #       Such devices are switched to one filter per tree, and the choice is kept across reconnects.
+                self.split_filters = True
+                self.logger.info(f'Combined discovery filter failed on {self.ip_address} ({self.hostname}), using split filters: {str(e)}')
+
+        lldp_reply = self.manager.get(self.subtree_filter(lldp_tree))
+        interfaces_reply = self.manager.get(self.subtree_filter(interfaces_tree))
+
+        return (lldp_reply.data_ele, interfaces_reply.data_ele, (parsers.fingerprint(lldp_reply), parsers.fingerprint(interfaces_reply)))
+
+    # openconfig-interfaces subtree read by discovery: interface state and MAC address
+    def interfaces_tree(self):
+        return '''
+                        <interfaces xmlns="http://openconfig.net/yang/interfaces">
+                            <interface>
+                                <name></name>
+                                <state>
+                                    <enabled></enabled>
+                                </state>
+                                <ethernet xmlns="http://openconfig.net/yang/interfaces/ethernet">
                                     <state>
-                                        <enabled></enabled>
+                                        <mac-address></mac-address>
                                     </state>
-                                    <ethernet xmlns="http://openconfig.net/yang/interfaces/ethernet">
-                                        <state>
-                                            <mac-address></mac-address>
-                                        </state>
-                                    </ethernet>
-                                </interface>
-                            </interfaces>
-                        </filter>
-                        '''
-        
-        acl_filter = '''
-                    <filter xmlns="urn:ietf:params:xml:ns:netconf:base:1.0">
-                        <acl xmlns="http://openconfig.net/yang/acl">
-                            <interfaces>
-                            </interfaces>
-                        </acl>
-                    </filter>
+                                </ethernet>
+                            </interface>
+                        </interfaces>
                     '''
 
-        try:
-            lldp_reply = ET.fromstring(self.manager.get(lldp_filter).data_xml)
-            interfaces_reply = ET.fromstring(self.manager.get(interfaces_filter).data_xml)
-            acl_reply = ET.fromstring(self.manager.get(acl_filter).data_xml)
+    # openconfig-interfaces state {interface_name: {'enabled': X, 'hw_addr': X}, ...}.
+    # Read from the operational cache when discovery read it recently, otherwise from the device
+    def interfaces_state(self):
+        interfaces = self.operational.get('interfaces')
 
-            disabled_interfaces = []
+        if interfaces is None:
+            interfaces = parsers.parse_interfaces(self.manager.get(self.subtree_filter(self.interfaces_tree())).data_ele)
+            self.operational.put('interfaces', interfaces)
 
-            # Clears neighbors and interfaces
-            self.neighbors = {}
-            self.interfaces = []
+        return interfaces
 
-            for interface in lldp_reply.findall('.//{http://openconfig.net/yang/lldp}interface'):
-                interface_name = interface.find('.//{http://openconfig.net/yang/lldp}name').text
-                
-                # Same interface but in openconfig-interfaces tree, instead of openconfig-lldp
-                non_lldp_interface = interfaces_reply.find('.//{http://openconfig.net/yang/interfaces}interface[{http://openconfig.net/yang/interfaces}name="' + interface_name +'"]')
+    # Forget cached interface state after changing it, and process the next discovery replies even if unchanged
+    def invalidate_interfaces(self):
+        self.operational.invalidate('interfaces')
+        self.replies_fingerprint = None
 
-                mac_address = non_lldp_interface.find('.//{http://openconfig.net/yang/interfaces/ethernet}mac-address').text
+    # Apply/remove ACL and route-map on interface, only when the desired binding differs from the applied one
+    def update_bindings(self, interface):
+        if (self.acl_statements > 0) != (interface in self.acl_bindings):
+            self.apply_acl_interface(interface, deconf=(self.acl_statements == 0))
 
-                # Make sure ACL is applied/not applied to interface when there is (no) ACL statements
-                if self.acl_statements > 0:
-                    if acl_reply.find('.//{http://openconfig.net/yang/acl}interface[{http://openconfig.net/yang/acl}id="' + interface_name + '"]') is None:
-                        self.apply_acl_interface(interface_name)
-                else:
-                    if acl_reply.find('.//{http://openconfig.net/yang/acl}interface[{http://openconfig.net/yang/acl}id="' + interface_name + '"]') is not None:
-                        self.apply_acl_interface(interface_name, deconf=True)
+        if (self.route_map_statements > 0) != (interface in self.route_map_bindings):
+            self.apply_route_map_interface(interface, deconf=(self.route_map_statements == 0))
 
-                # Make sure route-map is applied/not applied to interface when there is (no) route-map statements
-                if self.route_map_statements > 0:
-                    self.apply_route_map_interface(interface_name)
-                else:
-                    self.apply_route_map_interface(interface_name, deconf=True)
+    # Read ACL and route-map interface bindings from the device, replacing the tracked ones.
+    # Runs after connecting, then every BINDINGS_RECONCILE_INTERVAL seconds, to catch changes not made by this controller
+    def reconcile_bindings(self):
+        acl_tree = '''
+                        <acl xmlns="http://openconfig.net/yang/acl">
+                            <interfaces>
+                                <interface>
+                                    <id></id>
+                                </interface>
+                            </interfaces>
+                        </acl>
+                    '''
 
-                # Add interface to interfaces
-                self.interfaces.append({'interface_name': interface_name, 'hw_addr': mac_address})
+        route_map_tree = '''
+                        <native xmlns="http://cisco.com/ns/yang/Cisco-IOS-XE-native">
+                            <interface>
+                                <GigabitEthernet>
+                                    <name></name>
+                                    <ip>
+                                        <policy></policy>
+                                    </ip>
+                                </GigabitEthernet>
+                            </interface>
+                        </native>
+                    '''
 
-                # Check if interface is disabled or LLDP is disabled (Make sure interface is not disabled by policy first)
-                if interface_name in self.disabled:
-                    continue
+        # Same filters as discovery: one get for both trees, or one per tree on devices that need it (see get_discovery_replies)
+        if self.split_filters:
+            acl_reply = self.manager.get(self.subtree_filter(acl_tree)).data_ele
+            route_map_reply = self.manager.get(self.subtree_filter(route_map_tree)).data_ele
+        else:
+            acl_reply = route_map_reply = self.manager.get(self.subtree_filter(acl_tree, route_map_tree)).data_ele
 
-                if not (non_lldp_interface.find('.//{http://openconfig.net/yang/interfaces}enabled').text == 'true'
-                    and interface.find('.//{http://openconfig.net/yang/lldp}enabled').text == 'true'):
-                    disabled_interfaces.append(interface_name)
-                    continue
-                
-                neighbor_count = 0
-                for neighbor in interface.findall('.//{http://openconfig.net/yang/lldp}neighbor'):
-                    neighbor_name = neighbor.find('.//{http://openconfig.net/yang/lldp}system-name').text
+        acl_bindings = parsers.parse_acl_bindings(acl_reply)
+        route_map_bindings = parsers.parse_route_map_bindings(route_map_reply, f'MAP_{self.hostname}')
 
-                    neighbor_count += 1
+        # Bindings changed outside this controller are fixed while processing discovery replies, even unchanged ones
+        if acl_bindings != self.acl_bindings or route_map_bindings != self.route_map_bindings:
+            self.replies_fingerprint = None
 
-                    # Add neighbor to neighbors
-                    self.neighbors[neighbor_name] = interface_name
+        self.acl_bindings = acl_bindings
+        self.route_map_bindings = route_map_bindings
+        self.bindings_time = time.time()
 
-                self.logger.debug(f'Found {neighbor_count} neighbors on {interface_name} {self.ip_address} ({self.hostname})')
-            if len(disabled_interfaces) > 0:
-                self.logger.debug(f'Found {len(disabled_interfaces)} disabled interfaces on {self.ip_address} ({self.hostname})')
-                self.activate_interfaces(disabled_interfaces)
-        except Exception as e:
-            # Assume any exception means device is disconnected
-            self.manager = None
-            self.logger.debug(f'Failed to get neighbors from {self.ip_address} ({self.hostname}): {str(e)}')
+        self.logger.debug(f'Reconciled bindings on {self.ip_address} ({self.hostname}), ACL: {acl_bindings}, route-map: {route_map_bindings}')
+
+    # Wrap subtrees in a NETCONF subtree filter
+    def subtree_filter(self, *trees):
+        return f'''
+                    <filter xmlns="urn:ietf:params:xml:ns:netconf:base:1.0">{''.join(trees)}
+                    </filter>
+                '''
 
     # Activate interfaces and enable LLDP
     def activate_interfaces(self, disabled_interfaces):        
@@ -446,35 +1569,17 @@ class Device:
                         </config>
                     '''
             
-            filter = f'''
-                        <filter xmlns="urn:ietf:params:xml:ns:netconf:base:1.0">
-                            <interfaces xmlns="http://openconfig.net/yang/interfaces">
-                                <interface>
-                                    <name>{interface}</name>
-                                    <ethernet xmlns="http://openconfig.net/yang/interfaces/ethernet">
-                                        <state>
-                                            <mac-address></mac-address>
-                                        </state>
-                                    </ethernet>
-                                </interface>
-                            </interfaces>
-                        </filter>        
-                    '''
-
+            # Interface is already in self.interfaces with its MAC address, only its neighbors are missing
             try:
                 self.manager.edit_config(config=config)
 
-                interfaces_reply = ET.fromstring(self.manager.get(filter).data_xml)
-
-                mac_address = interfaces_reply.find('.//{http://openconfig.net/yang/interfaces/ethernet}mac-address').text
-
-                self.interfaces.append({'interface_name': interface, 'hw_addr': mac_address})
-
                 self.logger.debug(f'Activated interface {interface} on {self.ip_address} ({self.hostname})')
             except Exception as e:
                 self.logger.error(f'Failed to activate interface {interface} on {self.ip_address} ({self.hostname}): {str(e)}')
 
         self.manager.commit()
+
+        self.invalidate_interfaces()
     
     # Configure address on interface
     def configure_address(self, interface, address, prefix, deconf=False):
@@ -507,8 +1612,7 @@ class Device:
                 '''
         
         try:
-            self.manager.edit_config(config=config)
-            self.manager.commit()
+            self.edit(config)
 
             self.logger.debug(f'Configured ({not deconf}) address {address}/{prefix} on {interface} on {self.ip_address} ({self.hostname})')
 
@@ -547,21 +1651,15 @@ class Device:
                 '''
         
         try:
-            interface_reply = ET.fromstring(self.manager.get(filter).data_xml)
-
-            for (i, interface) in enumerate(interface_reply.findall('.//{http://openconfig.net/yang/interfaces}interface')):
-                interface_name = interface.find('.//{http://openconfig.net/yang/interfaces}name').text
-                address = interface.find('.//{http://openconfig.net/yang/interfaces/ip}ip')
+            interface_reply = self.manager.get(filter).data_ele
 
+            for (i, (interface_name, address, prefix)) in enumerate(parsers.parse_addresses(interface_reply)):
                 # Skip management interface
                 if i == 0:
                     continue
 
                 if address is not None:
-                    address = address.text
-                    prefix = interface.find('.//{http://openconfig.net/yang/interfaces/ip}prefix-length').text
-
-                    self.configurations.append(f'address {interface_name} {address}/{prefix}')
+                    self.configurations.add(f'address {interface_name} {address}/{prefix}')
             
             self.logger.debug(f'Loaded configured addresses on {self.ip_address} ({self.hostname})')
 
@@ -569,15 +1667,37 @@ class Device:
             self.logger.error(f'Failed to load configured addresses on {self.ip_address} ({self.hostname}): {str(e)}')
             return
 
-    # Configure route on device
-    def configure_route(self, destination, prefix, interface, next_hop, deconf=False):
-        deconf_str = ' operation="delete"' if deconf else ''
-        conf_str = f'''
+    # Configure route on device. Deconfiguring deletes only the next hop of the route (by its index),
+    # or the whole prefix with all its next hops when interface and next_hop are None.
+    # old is the (interface, next_hop) of a next hop of the prefix deleted in the same edit
+    def configure_route(self, destination, prefix, interface, next_hop, deconf=False, old=None):
+        whole_prefix = deconf and interface is None
+        deconf_str = ' operation="delete"' if whole_prefix else ''
+        index = f'{interface}_{next_hop}_{destination}_{prefix}'
+        old_index = f'{old[0]}_{old[1]}_{destination}_{prefix}' if old is not None else None
+
+        if whole_prefix:
+            conf_str = ''
+        elif deconf:
+            conf_str = f'''
                                             <next-hops>
+                                                <next-hop operation="delete">
+                                                    <index>{index}</index>
+                                                </next-hop>
+                                            </next-hops>
+'''
+        else:
+            old_str = f'''
+                                                <next-hop operation="delete">
+                                                    <index>{old_index}</index>
+                                                </next-hop>''' if old_index not in (None, index) else ''
+
+            conf_str = f'''
+                                            <next-hops>{old_str}
                                                 <next-hop>
-                                                    <index>{interface}_{next_hop}_{destination}_{prefix}</index>
+                                                    <index>{index}</index>
                                                     <config>
-                                                        <index>{interface}_{next_hop}_{destination}_{prefix}</index>
+                                                        <index>{index}</index>
                                                         <next-hop>{next_hop}</next-hop>
                                                         <metric>1</metric>
                                                     </config>
@@ -588,7 +1708,7 @@ class Device:
                                                     </interface-ref>
                                                 </next-hop>
                                             </next-hops>
-''' if not deconf else ''
+'''
 
         config = f'''
                     <config xmlns="urn:ietf:params:xml:ns:netconf:base:1.0">
@@ -616,8 +1736,7 @@ class Device:
             '''
         
         try:
-            self.manager.edit_config(config=config)
-            self.manager.commit()
+            self.edit(config)
 
             self.logger.debug(f'Configured ({not deconf}) route {destination}/{prefix} via {next_hop} on {interface} on {self.ip_address} ({self.hostname})')
 
@@ -668,11 +1787,10 @@ class Device:
                 '''
         
         try:
-            route_reply = ET.fromstring(self.manager.get(filter).data_xml)
+            route_reply = self.manager.get(filter).data_ele
 
             # if route_reply.find('.//{http://openconfig.net/yang/network-instance}static-route') is not None:
-            self.manager.edit_config(config=config)
-            self.manager.commit()
+            self.edit(config)
             
             self.logger.debug(f'Deconfigured routes on {self.ip_address} ({self.hostname})')
 
@@ -681,8 +1799,8 @@ class Device:
             return
     
     # Configure ACL statement on device
-    def configure_acl(self, acl_name, seq, rules, permit=False, deconf=False):
-        deconf_str = ' operation="delete"' if deconf else ''
+    def configure_acl(self, acl_name, seq, rules, permit=False, deconf=False, replace=False):
+        deconf_str = ' operation="delete"' if deconf else (' operation="replace"' if replace else '')
 
         (src_ip, dst_ip, proto, src_port, dst_port) = rules
 
@@ -742,8 +1860,7 @@ class Device:
         '''
 
         try:
-            self.manager.edit_config(config=config)
-            self.manager.commit()
+            self.edit(config)
             
             self.logger.debug(f'Configured ({not deconf}) ACL {acl_name} statement {seq}: {src_ip} {dst_ip} {proto} {src_port} {dst_port} on {self.ip_address} ({self.hostname})')
 
@@ -793,11 +1910,9 @@ class Device:
         '''
 
         try:
-            acl_reply = ET.fromstring(self.manager.get(filter).data_xml)
-
-            for acl in acl_reply.findall('.//{http://openconfig.net/yang/acl}acl-set'):
-                acl_name = acl.find('.//{http://openconfig.net/yang/acl}name').text
+            acl_reply = self.manager.get(filter).data_ele
 
+            for acl_name in parsers.parse_acl_sets(acl_reply):
                 config = f'''
                             <config xmlns="urn:ietf:params:xml:ns:netconf:base:1.0">
                                 <acl xmlns="http://openconfig.net/yang/acl">
@@ -819,14 +1934,15 @@ class Device:
             self.logger.error(f'Failed to deconfigured ACL ({acl_name}) on {self.ip_address} ({self.hostname}): {str(e)}.\n{config}')
             return
     
+    # Apply/remove ACL on interface, and track the binding
     def apply_acl_interface(self, interface, deconf=False):
-        deconf_str = ' operation="delete"' if deconf else ''
+        deconf_str = ' operation="remove"' if deconf else ''
 
         config = f'''
                     <config xmlns="urn:ietf:params:xml:ns:netconf:base:1.0">
                         <acl xmlns="http://openconfig.net/yang/acl">
-                            <interfaces{deconf_str}>
-                                <interface>
+                            <interfaces>
+                                <interface{deconf_str}>
                                     <id>{interface}</id>
                                     <config>
                                         <id>{interface}</id>
@@ -854,23 +1970,30 @@ class Device:
         '''
 
         try:
-            self.manager.edit_config(config=config)
-            self.manager.commit()
+            self.edit(config)
+
+            if deconf:
+                self.acl_bindings.discard(interface)
+            else:
+                self.acl_bindings.add(interface)
 
             self.logger.debug(f'Configured ACL ({not deconf}) on interface {interface} on {self.ip_address} ({self.hostname})')
         except Exception as e:
             self.logger.error(f'Failed to configure ACL ({not deconf}) on interface  {interface} on {self.ip_address} ({self.hostname}): {str(e)}.\n{config}')    
 
     # Configure route-map on device
-    def configure_route_map(self, src_ip, dst_ip, proto, src_port, dst_port, port, deconf=False):
+    # id is given to rewrite an existing entry (drift repair), which isn't counted again
+    def configure_route_map(self, src_ip, dst_ip, proto, src_port, dst_port, port, deconf=False, id=None, replace=False):
         deconf_str = ' operation="delete"' if deconf else ''
+        replace_str = ' operation="replace"' if replace else '' # Next hop of the entry is replaced instead of added to
         route_map_name = f'MAP_{self.hostname}'
+        repair = id is not None
         
         key = f'{src_ip}_{dst_ip}_{proto}_{src_port}_{dst_port}_{port}'
-        id = self.get_next_id() if not deconf else self.route_map_ids[key]
+        id = id if repair else (self.get_next_id() if not deconf else self.route_map_ids[key])
         acl_name = f'ACL_route-f_{self.hostname}_{id}'
 
-        if self.configure_acl(acl_name, 10, (src_ip, dst_ip, proto, src_port, dst_port), permit=True, deconf=deconf):
+        if replace or self.configure_acl(acl_name, 10, (src_ip, dst_ip, proto, src_port, dst_port), permit=True, deconf=deconf):
             next_hop = self.get_next_hop_from_port(port)
 
             if next_hop is not None:
@@ -884,7 +2007,7 @@ class Device:
                                         <operation>permit</operation>
                                         <set>
                                             <ip>
-                                                <next-hop>
+                                                <next-hop{replace_str}>
                                                     <address>{next_hop}</address>
                                                 </next-hop>
                                             </ip>
@@ -903,11 +2026,11 @@ class Device:
                         '''
                 
                 try:
-                    self.manager.edit_config(config=config)
-                    self.manager.commit()
+                    self.edit(config)
 
-                    self.route_map_statements += (1 if not deconf else -1)
-                    self.route_map_ids[key] = id
+                    if not repair:
+                        self.route_map_statements += (1 if not deconf else -1)
+                        self.route_map_ids[key] = id
 
                     self.logger.debug(f'Configured ({not deconf}) route-map to port {port} on {self.ip_address} ({self.hostname})')
 
@@ -923,10 +2046,12 @@ class Device:
             self.logger.error(f'Failed to configure ({not deconf}) ACL for route-map to port {port} on {self.ip_address} ({self.hostname})')
             return False
         
+    # Apply/remove route-map on interface, and track the binding
     def apply_route_map_interface(self, interface, deconf=False):
-        deconf_str = ' operation="delete"' if deconf else ''
+        deconf_str = ' operation="remove"' if deconf else ''
         route_map_name = f'MAP_{self.hostname}'
 
+        interface_name = interface
         interface = interface.replace('GigabitEthernet', '')
 
         config = f'''
@@ -954,8 +2079,12 @@ class Device:
         '''
 
         try:
-            self.manager.edit_config(config=config)
-            self.manager.commit()
+            self.edit(config)
+
+            if deconf:
+                self.route_map_bindings.discard(interface_name)
+            else:
+                self.route_map_bindings.add(interface_name)
 
             self.logger.debug(f'Configured ({not deconf}) route-map on interface {interface} on {self.ip_address} ({self.hostname})')
         except Exception as e:
@@ -974,11 +2103,9 @@ class Device:
         '''
 
         try:
-            route_map_reply = ET.fromstring(self.manager.get(filter).data_xml)
-
-            for route_map in route_map_reply.findall('.//{http://cisco.com/ns/yang/Cisco-IOS-XE-native}route-map'):
-                route_map_name = route_map.find('.//{http://cisco.com/ns/yang/Cisco-IOS-XE-native}name').text
+            route_map_reply = self.manager.get(filter).data_ele
 
+            for route_map_name in parsers.parse_route_maps(route_map_reply):
                 config = f'''
                             <config xmlns="urn:ietf:params:xml:ns:netconf:base:1.0">
                                 <native xmlns="http://cisco.com/ns/yang/Cisco-IOS-XE-native">
@@ -999,23 +2126,8 @@ class Device:
     
     # Configure disable on device
     def configure_disable(self, port, deconf=False):
-        filter = f'''
-                        <filter xmlns="urn:ietf:params:xml:ns:netconf:base:1.0">
-                            <interfaces xmlns="http://openconfig.net/yang/interfaces">
-                                <interface>
-                                    <name>{port}</name>
-                                    <state>
-                                        <enabled></enabled>
-                                    </state>
-                                </interface>
-                            </interfaces>
-                        </filter>
-                        '''
-        
         try:
-            interface_reply = ET.fromstring(self.manager.get(filter).data_xml)
-
-            if interface_reply.find('.//{http://openconfig.net/yang/interfaces}enabled').text == 'true' and not deconf:
+            if self.interfaces_state()[port]['enabled'] and not deconf:
                 config = f'''
                             <config xmlns="urn:ietf:params:xml:ns:netconf:base:1.0">
                                 <interfaces xmlns="http://openconfig.net/yang/interfaces">
@@ -1030,8 +2142,8 @@ class Device:
                             </config>
                         '''
                 
-                self.manager.edit_config(config=config)
-                self.manager.commit()
+                self.edit(config)
+                self.invalidate_interfaces()
             
             if not port in self.disabled and not deconf:
                 self.disabled.append(port)
@@ -1054,13 +2166,9 @@ class Device:
     # TODO: temporary solution, assumes exit port network is /30, so there's only one possible next hop address
     # Get next hop address from exit port
     def get_next_hop_from_port(self, port):
-        for c in self.configurations:
-            split = c.split(' ')
-            if split[0] == 'address' and split[1] == port:
-                (address, prefix) = split[2].split('/')
-                other = self.get_other_address(address)
-                return other
-                
+        for conf in self.configurations.by_interface(port, kind='address'):
+            (address, prefix) = conf.split(' ')[2].split('/')
+            return self.get_other_address(address)
 
     # TODO: Move to a helper class
     # Get network address from host address and prefix
@@ -0,0 +1,166 @@
+import hashlib
+
+from lxml import etree
+
+# Parsers for NETCONF <data> replies.
+# Each parser walks its reply once using compiled paths, and returns plain dicts/lists keyed by interface or set name,
+# so callers never search a whole reply for a single interface.
+
+LLDP = '{http://openconfig.net/yang/lldp}'
+IF = '{http://openconfig.net/yang/interfaces}'
+ETH = '{http://openconfig.net/yang/interfaces/ethernet}'
+IP = '{http://openconfig.net/yang/interfaces/ip}'
+ACL = '{http://openconfig.net/yang/acl}'
+NATIVE = '{http://cisco.com/ns/yang/Cisco-IOS-XE-native}'
+NI = '{http://openconfig.net/yang/network-instance}'
+
+NAMESPACES = {
+    'lldp': 'http://openconfig.net/yang/lldp',
+    'if': 'http://openconfig.net/yang/interfaces',
+    'acl': 'http://openconfig.net/yang/acl',
+    'native': 'http://cisco.com/ns/yang/Cisco-IOS-XE-native',
+    'ni': 'http://openconfig.net/yang/network-instance'
+}
+
+_lldp_interfaces = etree.XPath('lldp:lldp/lldp:interfaces/lldp:interface', namespaces=NAMESPACES)
+_interfaces = etree.XPath('if:interfaces/if:interface', namespaces=NAMESPACES)
+_acl_sets = etree.XPath('acl:acl/acl:acl-sets/acl:acl-set', namespaces=NAMESPACES)
+_acl_interfaces = etree.XPath('acl:acl/acl:interfaces/acl:interface', namespaces=NAMESPACES)
+_route_maps = etree.XPath('native:native/native:route-map', namespaces=NAMESPACES)
+_static_routes = etree.XPath('ni:network-instances/ni:network-instance[ni:name="default"]/ni:protocols/ni:protocol/ni:static-routes/ni:static', namespaces=NAMESPACES)
+_native_gigabit_ethernets = etree.XPath('native:native/native:interface/native:GigabitEthernet', namespaces=NAMESPACES)
+
+# Fingerprint of the content of an ncclient reply, from its raw XML.
+# The <rpc-reply> start tag is skipped, as its message-id differs in every reply
+def fingerprint(reply):
+    raw = reply.xml
+    start = raw.find('>', raw.find('rpc-reply')) + 1
+
+    return hashlib.blake2b(raw[start:].encode(), digest_size=16).digest()
+
+# Parse openconfig-lldp interfaces
+# {interface_name: {'enabled': True, 'neighbors': [system_name, ...]}, ...}
+def parse_lldp(data):
+    interfaces = {}
+
+    for interface in _lldp_interfaces(data):
+        interfaces[interface.findtext(f'{LLDP}name')] = {
+            'enabled': interface.findtext(f'{LLDP}state/{LLDP}enabled') == 'true',
+            'neighbors': [name.text for name in interface.iterfind(f'{LLDP}neighbors/{LLDP}neighbor/{LLDP}state/{LLDP}system-name')]
+        }
+
+    return interfaces
+
+# Parse openconfig-interfaces state
+# {interface_name: {'enabled': True, 'hw_addr': 'aa:aa:aa:aa:aa:aa'}, ...}
+def parse_interfaces(data):
+    interfaces = {}
+
+    for interface in _interfaces(data):
+        interfaces[interface.findtext(f'{IF}name')] = {
+            'enabled': interface.findtext(f'{IF}state/{IF}enabled') == 'true',
+            'hw_addr': interface.findtext(f'{ETH}ethernet/{ETH}state/{ETH}mac-address')
+        }
+
+    return interfaces
+
+# Parse first IPv4 address of subinterface 0 of every interface, in reply order
+# [(interface_name, address, prefix), ...], address and prefix are None for interfaces without address
+def parse_addresses(data):
+    addresses = []
+
+    for interface in _interfaces(data):
+        address = interface.find(f'{IF}subinterfaces/{IF}subinterface/{IP}ipv4/{IP}addresses/{IP}address')
+
+        if address is None:
+            addresses.append((interface.findtext(f'{IF}name'), None, None))
+        else:
+            addresses.append((interface.findtext(f'{IF}name'), address.findtext(f'{IP}ip'), address.findtext(f'{IP}config/{IP}prefix-length')))
+
+    return addresses
+
+# Parse configured administrative state of every interface, in reply order
+# [(interface_name, enabled), ...], enabled is False only for interfaces configured as disabled
+def parse_enabled(data):
+    return [(interface.findtext(f'{IF}name'), interface.findtext(f'{IF}config/{IF}enabled') != 'false') for interface in _interfaces(data)]
+
+# Parse ACL set names
+def parse_acl_sets(data):
+    return [acl_set.findtext(f'{ACL}name') for acl_set in _acl_sets(data)]
+
+# Parse IDs of interfaces with ACLs applied
+def parse_acl_bindings(data):
+    return {interface.findtext(f'{ACL}id') for interface in _acl_interfaces(data)}
+
+# Parse IOS-XE route-map names
+def parse_route_maps(data):
+    return [route_map.findtext(f'{NATIVE}name') for route_map in _route_maps(data)]
+
+# Parse names of GigabitEthernet interfaces with route_map_name applied as policy
+def parse_route_map_bindings(data, route_map_name):
+    bindings = set()
+
+    for interface in _native_gigabit_ethernets(data):
+        # Policy leaves may be in an augmenting namespace, so match by local name
+        for element in interface.iter('{*}route-map'):
+            if element.text == route_map_name:
+                bindings.add(f'GigabitEthernet{interface.findtext(f"{NATIVE}name")}')
+                break
+
+    return bindings
+
+# Parse static routes of the default network instance
+# [(prefix, [(next_hop, interface, index), ...]), ...], next_hop/interface are None when missing
+def parse_static_routes(data):
+    routes = []
+
+    for static in _static_routes(data):
+        next_hops = []
+
+        for next_hop in static.iterfind(f'{NI}next-hops/{NI}next-hop'):
+            next_hops.append((next_hop.findtext(f'{NI}config/{NI}next-hop'), next_hop.findtext(f'{NI}interface-ref/{NI}config/{NI}interface'), next_hop.findtext(f'{NI}index')))
+
+        routes.append((static.findtext(f'{NI}prefix'), next_hops))
+
+    return routes
+
+# Parse ACL entries of every ACL set
+# {acl_name: {sequence_id: {'src_ip': X, 'dst_ip': X, 'proto': X, 'src_port': X, 'dst_port': X, 'action': X}, ...}, ...}
+def parse_acl_entries(data):
+    acls = {}
+
+    for acl_set in _acl_sets(data):
+        entries = {}
+
+        for entry in acl_set.iterfind(f'{ACL}acl-entries/{ACL}acl-entry'):
+            entries[int(entry.findtext(f'{ACL}sequence-id'))] = {
+                'src_ip': entry.findtext(f'{ACL}ipv4/{ACL}config/{ACL}source-address'),
+                'dst_ip': entry.findtext(f'{ACL}ipv4/{ACL}config/{ACL}destination-address'),
+                'proto': entry.findtext(f'{ACL}ipv4/{ACL}config/{ACL}protocol'),
+                'src_port': entry.findtext(f'{ACL}transport/{ACL}config/{ACL}source-port'),
+                'dst_port': entry.findtext(f'{ACL}transport/{ACL}config/{ACL}destination-port'),
+                'action': entry.findtext(f'{ACL}actions/{ACL}config/{ACL}forwarding-action')
+            }
+
+        acls[acl_set.findtext(f'{ACL}name')] = entries
+
+    return acls
+
+# Parse IOS-XE route-map entries
+# {route_map_name: {seq_no: {'next_hop': X, 'acl': X}, ...}, ...}
+def parse_route_map_entries(data):
+    route_maps = {}
+
+    for route_map in _route_maps(data):
+        entries = {}
+
+        # Entries are in the Cisco-IOS-XE-route-map namespace, so match by local name
+        for entry in route_map.iterfind('{*}route-map-without-order-seq'):
+            entries[int(entry.findtext('{*}seq_no'))] = {
+                'next_hop': entry.findtext('{*}set/{*}ip/{*}next-hop/{*}address'),
+                'acl': entry.findtext('{*}match/{*}ip/{*}address/{*}access-list')
+            }
+
+        route_maps[route_map.findtext(f'{NATIVE}name')] = entries
+
+    return route_maps
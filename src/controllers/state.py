@@ -0,0 +1,111 @@
+import json
+import logging
+import os
+import threading
+
+COMPACT_FACTOR = 4 # Compact the log once it holds this many records per live key
+
+# Append-only snapshot log of device state, one JSON record per line: {"key": X, "state": {...}}.
+# The last record of a key wins, and a record with "state": null deletes the key.
+# The log is compacted (rewritten with one record per key, then atomically renamed over the old one) when it grows
+# to COMPACT_FACTOR records per key, so writes are a single appended line and the file stays small.
+class StateStore:
+    def __init__(self, path):
+        self.path = path
+        self.states = {} # {key: state}, last written state of every key
+        self.records = 0 # Records in the log file
+
+        # Devices are checkpointed from discovery worker threads and from the Ryu thread
+        self.lock = threading.Lock()
+
+        self.logger = logging.getLogger('StateStore')
+
+        self.load()
+
+    # Read the log. A torn last line (crash while appending) is cut off, so the next record starts on its own line
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path, 'rb+') as file:
+            data = file.read()
+
+            if len(data) > 0 and not data.endswith(b'\n'):
+                self.logger.warning(f'Truncating torn record at the end of {self.path}')
+                file.truncate(data.rfind(b'\n') + 1)
+
+        with open(self.path, 'r') as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    self.logger.warning(f'Ignoring invalid record in {self.path}')
+                    continue
+
+                self.records += 1
+
+                if record['state'] is None:
+                    self.states.pop(record['key'], None)
+                else:
+                    self.states[record['key']] = record['state']
+
+    def get(self, key):
+        return self.states.get(key)
+
+    # Append state of key to the log
+    def put(self, key, state):
+        self.put_all([(key, state)])
+
+    # Append states of many keys with a single write, [(key, state), ...]
+    def put_all(self, items):
+        with self.lock:
+            lines = []
+
+            for (key, state) in items:
+                # Keep a decoded copy rather than the caller's (live) objects, so later changes to them are seen
+                line = json.dumps({'key': key, 'state': state}) + '\n'
+                state = json.loads(line)['state']
+
+                if self.states.get(key) == state:
+                    continue # Unchanged
+
+                if state is None:
+                    self.states.pop(key, None)
+                else:
+                    self.states[key] = state
+
+                lines.append(line)
+
+            if len(lines) == 0:
+                return
+
+            with open(self.path, 'a') as file:
+                file.writelines(lines)
+                file.flush()
+                os.fsync(file.fileno())
+
+            self.records += len(lines)
+
+            if self.records > COMPACT_FACTOR * max(len(self.states), 1):
+                self.compact()
+
+    def remove(self, key):
+        if key in self.states:
+            self.put(key, None)
+
+    # Rewrite the log with the last state of every key. Readers see either the old or the new file
+    def compact(self):
+        temp_path = f'{self.path}.tmp'
+
+        with open(temp_path, 'w') as file:
+            for (key, state) in self.states.items():
+                file.write(json.dumps({'key': key, 'state': state}) + '\n')
+
+            file.flush()
+            os.fsync(file.fileno())
+
+        os.replace(temp_path, self.path)
+
+        self.records = len(self.states)
+
+        self.logger.debug(f'Compacted {self.path} to {self.records} records')
@@ -0,0 +1,89 @@
+import collections
+import socket
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from ryu.lib import hub
+
+# Runs blocking work (ncclient RPCs, fsync) in native worker threads, outside the Ryu event loop.
+# Workers report finished work over a socket pair, which a Ryu thread reads to wake the Ryu threads waiting for it,
+# so waiting never blocks the event loop (OpenFlow handling keeps running) and doesn't poll.
+class WorkerPool:
+    def __init__(self, workers, name):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+
+        # Message channel from workers to Ryu: one byte per finished future, the futures themselves in self.finished
+        (self.reader, self.writer) = socket.socketpair()
+        self.finished = collections.deque() # Futures finished by workers, not dispatched yet (deque is thread-safe)
+        self.waiters = {} # {future: [hub.Event, ...]}, only used by Ryu threads
+
+        self.task = hub.spawn(self.dispatch)
+
+    # Run fn(*args) in a worker thread. Returns its future
+    def submit(self, fn, *args):
+        future = self.executor.submit(fn, *args)
+        future.add_done_callback(self.notify)
+
+        return future
+
+    # Wait from a Ryu thread until all futures are done, or at most timeout seconds (None to wait without limit).
+    # Returns True if all futures are done
+    def wait(self, futures, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        event = hub.Event()
+
+        try:
+            while True:
+                pending = [future for future in futures if not future.done()]
+
+                if len(pending) == 0:
+                    return True
+
+                remaining = None if deadline is None else deadline - time.time()
+
+                if remaining is not None and remaining <= 0:
+                    return False
+
+                # A future not done yet always notifies later, see notify
+                for future in pending:
+                    if event not in self.waiters.setdefault(future, []):
+                        self.waiters[future].append(event)
+
+                event.clear()
+                event.wait(timeout=remaining)
+        finally:
+            for future in list(self.waiters):
+                if event in self.waiters[future]:
+                    self.waiters[future].remove(event)
+
+                    if len(self.waiters[future]) == 0:
+                        self.waiters.pop(future)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+        hub.kill(self.task)
+
+        self.reader.close()
+        self.writer.close()
+
+    # Called by the worker thread that finished the future (or by submit, if it finished already)
+    def notify(self, future):
+        self.finished.append(future)
+
+        try:
+            self.writer.send(b'\0')
+        except OSError: # Closed by shutdown
+            pass
+
+    # Wake Ryu threads waiting for finished futures
+    def dispatch(self):
+        while True:
+            if not self.reader.recv(4096):
+                return
+
+            while len(self.finished) > 0:
+                future = self.finished.popleft()
+
+                for event in self.waiters.pop(future, []):
+                    event.set()
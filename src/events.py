@@ -8,9 +8,10 @@ class RequestNetconfDiscovery(EventRequestBase):
 
 # Reply for RequestEnableLldp
 class ReplyNetconfDiscovery(EventReplyBase):
-    def __init__(self, topology):
+    def __init__(self, topology, versions):
         super(ReplyNetconfDiscovery, self).__init__('ClassicTopologyDiscovery')
         self.topology = topology
+        self.versions = versions # {hostname: version}, a device's version changes with its interfaces or neighbors
 
 # Event containing NETCONF topology
 class EventNetconfTopology(EventBase):
@@ -78,4 +79,10 @@ class EventPolicyDeviceAPI(EventBase):
     def __init__(self, old_device, new_device):
         super(EventPolicyDeviceAPI, self).__init__()
         self.old_device = old_device
-        self.new_device = new_device
\ No newline at end of file
+        self.new_device = new_device
+
+# Event containing NETCONF RPC latency metrics, sent to API
+class EventNetconfMetrics(EventBase):
+    def __init__(self, metrics):
+        super(EventNetconfMetrics, self).__init__()
+        self.metrics = metrics
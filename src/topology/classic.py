@@ -15,6 +15,8 @@ class ClassicTopologyDiscovery(app_manager.RyuApp):
 
         self.logger.setLevel(logging.INFO)
 
+        self.versions = None # Device versions of the last sent topology
+
     def start(self):
         super(ClassicTopologyDiscovery, self).start()
 
@@ -30,7 +32,10 @@ class ClassicTopologyDiscovery(app_manager.RyuApp):
             rep = self.send_request(RequestNetconfDiscovery())
             end = time.time()
 
-            self.send_event_to_observers(EventNetconfTopology(rep.topology))
+            # Unchanged topology isn't sent, so TopologyManager and ConfigurationGenerator don't process it again
+            if rep.versions != self.versions:
+                self.versions = rep.versions
+                self.send_event_to_observers(EventNetconfTopology(rep.topology))
 
             self.logger.debug(f'NETCONF topology discovery took {end - start} seconds')
 
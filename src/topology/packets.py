@@ -0,0 +1,73 @@
+import struct
+
+# Minimal parsers and builders for the packets handled in packet-in, without scapy.
+# Fields are read in place from the received bytes with struct/memoryview, so no packet objects are allocated.
+
+ETH_TYPE_LLDP = 0x88cc
+ETH_TYPE_ARP = 0x0806
+
+ETH_HEADER = 14 # Destination MAC, source MAC, EtherType
+
+LLDP_TLV_END = 0
+LLDP_TLV_TTL = 3
+LLDP_TLV_SYSTEM_NAME = 5
+
+_uint16 = struct.Struct('!H') # EtherType, LLDP TLV header (7 bits type, 9 bits length) and TTL
+
+# ARP for IPv4 over Ethernet: htype, ptype, hlen, plen, op, sha, spa, tha, tpa
+_arp = struct.Struct('!HHBBH6s4s6s4s')
+
+# ARP reply without the addresses, see arp_reply
+_arp_reply_header = struct.pack('!HHHBBH', ETH_TYPE_ARP, 1, 0x0800, 6, 4, 2)
+
+# EtherType of Ethernet frame, None if too short
+def ethertype(data):
+    if len(data) < ETH_HEADER:
+        return None
+
+    return _uint16.unpack_from(data, 12)[0]
+
+# LLDP system name and TTL of Ethernet frame. Returns (system_name, ttl), either is None when its TLV is missing
+# or malformed. Parsing stops at a TLV that runs past the end of the frame
+def parse_lldp(data):
+    view = memoryview(data)
+    offset = ETH_HEADER
+    system_name = None
+    ttl = None
+
+    while offset + 2 <= len(view):
+        header = _uint16.unpack_from(view, offset)[0]
+        (tlv_type, length) = (header >> 9, header & 0x1ff)
+        offset += 2
+
+        if tlv_type == LLDP_TLV_END or offset + length > len(view):
+            break
+        elif tlv_type == LLDP_TLV_TTL and length >= 2:
+            ttl = _uint16.unpack_from(view, offset)[0]
+        elif tlv_type == LLDP_TLV_SYSTEM_NAME:
+            system_name = bytes(view[offset:offset + length]).decode(errors='replace')
+
+        offset += length
+
+    return (system_name, ttl)
+
+# ARP fields of Ethernet frame. Returns (op, sender_mac, sender_ip, target_mac, target_ip), addresses as bytes,
+# None if the frame is too short
+def parse_arp(data):
+    if len(data) < ETH_HEADER + _arp.size:
+        return None
+
+    (htype, ptype, hlen, plen, op, sha, spa, tha, tpa) = _arp.unpack_from(data, ETH_HEADER)
+
+    return (op, sha, spa, tha, tpa)
+
+# ARP reply to ARP request frame, from hw_addr (bytes) which owns the requested address. Same frame as
+# Ether(dst=request src, src=hw_addr) / ARP(op=2, hwsrc=hw_addr, psrc=request pdst, hwdst=request hwsrc, pdst=request psrc)
+def arp_reply(hw_addr, request):
+    (op, sha, spa, tha, tpa) = parse_arp(request)
+
+    return b''.join((request[6:12], hw_addr, _arp_reply_header, hw_addr, tpa, sha, spa))
+
+# Colon separated MAC address as bytes
+def mac_to_bytes(mac):
+    return bytes.fromhex(mac.replace(':', ''))
@@ -0,0 +1,42 @@
+import math
+
+# Timer wheel: slots of tick seconds, a key is kept in the slot of the tick it's due at (modulo the number of slots).
+# Scheduling, rescheduling and expiring a key are O(1), a slot also holds keys due in later rounds, which are skipped.
+# Time is advanced by the caller, one tick at a time
+class TimerWheel:
+    def __init__(self, tick, slots):
+        self.tick = tick
+        self.slots = [{} for i in range(slots)] # [{key: due tick}, ...]
+        self.due = {} # {key: due tick}
+        self.current = 0 # Ticks advanced
+
+    def __contains__(self, key):
+        return key in self.due
+
+    # Schedule key to expire after delay seconds (at least one tick), replacing its previous schedule
+    def schedule(self, key, delay):
+        self.cancel(key)
+
+        due = self.current + max(1, math.ceil(delay / self.tick))
+
+        self.due[key] = due
+        self.slots[due % len(self.slots)][key] = due
+
+    def cancel(self, key):
+        due = self.due.pop(key, None)
+
+        if due is not None:
+            self.slots[due % len(self.slots)].pop(key, None)
+
+    # Advance by one tick. Returns keys that expired
+    def advance(self):
+        self.current += 1
+        slot = self.slots[self.current % len(self.slots)]
+
+        expired = [key for (key, due) in slot.items() if due <= self.current]
+
+        for key in expired:
+            slot.pop(key)
+            self.due.pop(key)
+
+        return expired
@@ -1,4 +1,6 @@
+import collections
 import logging
+import random
 import time
 
 from ryu.base import app_manager
@@ -6,12 +8,27 @@ from ryu.controller.handler import set_ev_cls
 from ryu.controller import ofp_event
 from ryu.controller.handler import MAIN_DISPATCHER, DEAD_DISPATCHER
 from ryu.ofproto import ofproto_v1_3
+from ryu.lib import hub
 
-from scapy.layers.l2 import Ether, ARP
+from scapy.layers.l2 import Ether
 from scapy.contrib import lldp
 
+from src.configuration.store import ConfigurationStore
+from src.controllers.inventory import Inventory
+from src.topology import packets
+from src.topology.scheduler import TimerWheel
 from src.events import EventPolicyDeviceAPI, EventSdnDeviceAPI, EventSdnTopology, EventSdnConfigurations
 
+INVENTORY_PATH = 'config/sdn_inventory.jsonl' # SDN devices (label and datapath ID), see Inventory
+BATCH_SIZE = 100 # Configurations sent to a switch before a barrier
+MAX_BATCHES_IN_FLIGHT = 2 # Batches sent to a switch and not acknowledged by its barrier reply yet
+ARP_RESPONDER = False # Answer ARP requests for configured addresses in the switch (Nicira extensions), on switches that support them
+LLDP_TICK = 0.1 # Seconds per slot of the LLDP timer wheel
+LLDP_INTERVAL = 15 # Seconds between LLDP packets out of a port with a stable neighbor
+LLDP_FAST_INTERVAL = 1 # Seconds between LLDP packets out of a new port, or a port whose neighbor changed
+LLDP_FAST_PROBES = 3 # LLDP packets sent at LLDP_FAST_INTERVAL before a port falls back to LLDP_INTERVAL
+LLDP_JITTER = 0.2 # Random fraction added to or removed from every interval, so ports and switches don't send in sync
+
 # Handles topology discovery for SDN (OpenFlow) devices
 class SdnTopologyDiscovery(app_manager.RyuApp):
     _EVENTS = [EventSdnTopology, EventPolicyDeviceAPI]
@@ -23,28 +40,58 @@ class SdnTopologyDiscovery(app_manager.RyuApp):
 
         self.logger.setLevel(logging.INFO)
 
-        # Mapping datapath ID to label
+        # Mapping datapath ID to label, of connected devices
         self.labels = {}
 
         # Mapping label to datapath object
         self.datapaths = {}
+
+        # Labels of all devices seen, including previous sessions
+        self.inventory = Inventory(INVENTORY_PATH)
         
         self.load_all_labels()
         
         self.ports = {} # {label: [{'port_no': 1, 'hw_addr': 'aa:aa:aa:aa:aa:aa'}, ...]
+
+        # Serialized LLDP frames sent out of every port, rebuilt when the ports or the label of the switch change
+        # {label: {port_no: frame, ...}, ...}
+        self.lldp_frames = {}
+
+        # LLDP packets are sent per port when due on a timer wheel, see run_lldp
+        self.lldp_wheel = TimerWheel(LLDP_TICK, int(2 * LLDP_INTERVAL / LLDP_TICK))
+        self.lldp_fast = {} # {(dpid, port_no): LLDP packets left at LLDP_FAST_INTERVAL}
+
+        # Datapath IDs of switches supporting Nicira extensions (Open vSwitch), used for ARP responder flows
+        self.nicira = set()
         
         # LLDP database. 
         # Can be considered 2D dictonary, where first key is the label of the switch, and second key is the system name of the neighbor
         # {'label': {'system_name': {'port': 1, 'ttl': 120}, ...}, ...}
         self.lldp = {}
 
-        # Dictionary for applied configurations
-        # {label: [config1, config2, ...], ...}
+        # Dictionary for applied configurations, acknowledged by the switch (barrier reply without an error)
+        # {label: ConfigurationStore, ...}
         self.configurations = {}
 
+        # Configuration pushes, see reconcile
+        self.desired = {} # {label: [conf, ...]}, last received configurations
+        self.queued = {} # {dpid: deque([(conf, deconf), ...])}, operations waiting for a batch
+        self.in_flight = {} # {dpid: {(conf, deconf), ...}}, operations queued or sent, and not acknowledged yet
+        self.batches = {} # {(dpid, barrier xid): batch}, batches sent and waiting for their barrier reply
+        self.sent = {} # {(dpid, xid): (batch, conf, deconf)}, messages of batches in flight, to match errors with configurations
+        self.push_start = {} # {dpid: time}, start of the running push of switch
+        self.stale = set() # dpids that received configurations while a push was running
+        self.sending = None # (batch, conf, deconf) whose messages are being sent, see send
+
         # Stores current time. Used for LLDP timeout
         self.time = time.time()
 
+    def start(self):
+        super(SdnTopologyDiscovery, self).start()
+
+        # Sends LLDP packets in separate thread
+        self.lldp_task = hub.spawn(self.run_lldp)
+
     # TODO: move this to a separate app. Shouldn't be part of topology discovery
     # Configure SDN devices with received configurations
     @set_ev_cls(EventSdnConfigurations)
@@ -52,13 +99,146 @@ class SdnTopologyDiscovery(app_manager.RyuApp):
         configurations = ev.configurations
 
         for label in configurations:
-            if label in self.configurations:
-                for conf in self.configurations[label]:
-                    if conf not in configurations[label]:
-                        self.configure(label, conf, deconf=True)
+            self.desired[label] = configurations[label]
+            self.reconcile(label)
+
+    # Queue operations that make applied configurations of label match the desired ones, and send them in batches.
+    # Each batch ends with a barrier, its configurations are applied when the barrier reply arrives, except those that caused an error.
+    # Operations already in flight aren't queued again, and a switch that got new configurations during a push is reconciled after it
+    def reconcile(self, label):
+        if label not in self.datapaths:
+            return # Applied when the switch connects and the generator sends configurations again
+
+        dpid = self.datapaths[label].id
+        in_flight = self.in_flight.setdefault(dpid, set())
+
+        if len(in_flight) > 0:
+            self.stale.add(dpid)
+
+        (removed, added) = self.configurations.setdefault(label, ConfigurationStore()).diff(self.desired[label])
+        operations = [(conf, True) for conf in removed] + [(conf, False) for conf in added]
+        operations = [operation for operation in operations if operation not in in_flight]
+
+        if len(operations) == 0:
+            return
+
+        if len(in_flight) == 0:
+            self.push_start[dpid] = time.perf_counter()
+
+        in_flight.update(operations)
+        self.queued.setdefault(dpid, collections.deque()).extend(operations)
+
+        self.send_batches(dpid)
+
+    # Send queued operations of switch, while less than MAX_BATCHES_IN_FLIGHT batches wait for their barrier reply
+    def send_batches(self, dpid):
+        datapath = self.datapaths[self.labels[dpid]]
+        queued = self.queued[dpid]
+
+        while len(queued) > 0 and sum(1 for (batch_dpid, xid) in self.batches if batch_dpid == dpid) < MAX_BATCHES_IN_FLIGHT:
+            batch = {'dpid': dpid, 'operations': [], 'failed': set(), 'xids': [], 'start': time.perf_counter()}
+
+            # The barrier is sent even if an operation raises, so operations already in the batch are completed
+            try:
+                while len(queued) > 0 and len(batch['operations']) < BATCH_SIZE:
+                    (conf, deconf) = queued.popleft()
+                    batch['operations'].append((conf, deconf))
+
+                    self.sending = (batch, conf, deconf)
+
+                    try:
+                        success = self.configure(self.labels[dpid], conf, deconf=deconf)
+                    except Exception as e:
+                        self.logger.error(f'Failed to configure ({not deconf}) {conf} on {self.labels[dpid]}: {str(e)}')
+                        success = False
+
+                    if not success:
+                        batch['failed'].add((conf, deconf))
+            finally:
+                self.sending = None
+
+                barrier = datapath.ofproto_parser.OFPBarrierRequest(datapath)
+                datapath.set_xid(barrier)
+                self.batches[(dpid, barrier.xid)] = batch
+                datapath.send_msg(barrier)
+
+    # Send configuration message, tracked with the operation being sent so switch errors are matched with it
+    def send(self, datapath, msg):
+        datapath.set_xid(msg)
 
-            for conf in configurations[label]:
-                self.configure(label, conf)
+        if self.sending is not None:
+            (batch, conf, deconf) = self.sending
+            self.sent[(datapath.id, msg.xid)] = self.sending
+            batch['xids'].append(msg.xid)
+
+        datapath.send_msg(msg)
+
+    # Barrier reply: all messages of the batch before it were processed, so apply its configurations that didn't fail
+    @set_ev_cls(ofp_event.EventOFPBarrierReply, MAIN_DISPATCHER)
+    def barrier_reply_handler(self, ev):
+        msg = ev.msg
+        dpid = msg.datapath.id
+        batch = self.batches.pop((dpid, msg.xid), None)
+
+        if batch is None:
+            return
+
+        label = self.labels[dpid]
+        configurations = self.configurations.setdefault(label, ConfigurationStore())
+
+        for xid in batch['xids']:
+            self.sent.pop((dpid, xid), None)
+
+        for (conf, deconf) in batch['operations']:
+            self.in_flight[dpid].discard((conf, deconf))
+
+            if (conf, deconf) in batch['failed']:
+                continue
+
+            if deconf:
+                configurations.discard(conf)
+            else:
+                configurations.add(conf)
+
+        seconds = time.perf_counter() - batch['start']
+        self.logger.debug(f'Programmed {len(batch["operations"])} configurations on {label} in {seconds:.3f} seconds, {len(batch["failed"])} failed')
+
+        if len(self.queued[dpid]) > 0:
+            self.send_batches(dpid)
+        elif len(self.in_flight[dpid]) == 0:
+            seconds = time.perf_counter() - self.push_start.pop(dpid)
+            self.logger.info(f'Configured {label}: {len(configurations)} configurations applied in {seconds:.3f} seconds')
+
+            if dpid in self.stale:
+                self.stale.discard(dpid)
+                self.reconcile(label)
+
+    # Switch error, mark the configuration that caused it as failed
+    @set_ev_cls(ofp_event.EventOFPErrorMsg, MAIN_DISPATCHER)
+    def error_handler(self, ev):
+        msg = ev.msg
+        operation = self.sent.get((msg.datapath.id, msg.xid))
+
+        if operation is None:
+            return
+
+        (batch, conf, deconf) = operation
+        batch['failed'].add((conf, deconf))
+
+        self.logger.error(f'Failed to configure ({not deconf}) {conf} on {self.labels.get(msg.datapath.id)}: error type {msg.type}, code {msg.code}')
+
+    # Drop push of disconnected switch, its operations are sent again after it connects
+    def drop_push(self, dpid):
+        self.queued.pop(dpid, None)
+        self.in_flight.pop(dpid, None)
+        self.push_start.pop(dpid, None)
+        self.stale.discard(dpid)
+
+        for key in [key for key in self.batches if key[0] == dpid]:
+            self.batches.pop(key)
+
+        for key in [key for key in self.sent if key[0] == dpid]:
+            self.sent.pop(key)
     
     # Run device instruction from API
     @set_ev_cls(EventSdnDeviceAPI)
@@ -74,41 +254,33 @@ class SdnTopologyDiscovery(app_manager.RyuApp):
             dp = self.datapaths[new_name]
 
             self.labels[dp.id] = new_name
-            self.all_labels[dp.id] = new_name
+            self.inventory.rename(old_name, new_name)
             
             self.ports[new_name] = self.ports.pop(old_name)
             self.lldp[new_name] = self.lldp.pop(old_name)
 
-            lines = []
+            # Frames carry the label as system name
+            self.lldp_frames.pop(old_name, None)
+            self.build_lldp_frames(new_name)
 
-            with open('config/sdn.txt', 'r') as file:
-                for line in file.readlines():
-                    if line.strip() == f'{dp.id}:{old_name}':
-                        lines.append(f'{dp.id}:{new_name}\n')
-                    else:
-                        lines.append(line)
-            
-            with open('config/sdn.txt', 'w') as file:
-                file.writelines(lines)
+            if old_name in self.configurations:
+                self.configurations[new_name] = self.configurations.pop(old_name)
+
+            if old_name in self.desired:
+                self.desired[new_name] = self.desired.pop(old_name)
 
             self.send_event_to_observers(EventPolicyDeviceAPI(old_name, new_name))
 
-    # Configure device
+    # Send messages of configuration to device. Returns False if it can't be sent,
+    # it's applied when the switch acknowledges it (see barrier_reply_handler)
     def configure(self, label, config, deconf=False):
-        if not deconf and (label in self.configurations and config in self.configurations[label]):
-            return # Configuration already applied
-        
         split = config.split(' ')
 
         if split[0] == 'address':
             interface = split[1]
             (address, prefix) = split[2].split('/')
 
-            if self.configure_address(label, interface, address, prefix, deconf=deconf):
-                if deconf:
-                    self.remove_dict_list(self.configurations, label, config)
-                else:
-                    self.append_dict_list(self.configurations, label, config)
+            return self.configure_address(label, interface, address, prefix, deconf=deconf)
 
         elif split[0] == 'route':
             (address, prefix) = split[1].split('/')
@@ -116,42 +288,28 @@ class SdnTopologyDiscovery(app_manager.RyuApp):
 
             interface = split[2]
 
-            if self.configure_route(label, destination, prefix, interface, deconf=deconf):
-                if deconf:
-                    self.remove_dict_list(self.configurations, label, config)
-                else:
-                    self.append_dict_list(self.configurations, label, config)
+            return self.configure_route(label, destination, prefix, interface, deconf=deconf)
         
         elif split[0] == 'block':
             (src_ip, dst_ip, proto, src_port, dst_port) = split[1:]
 
-            if self.configure_block(label, src_ip, dst_ip, proto, src_port, dst_port, deconf=deconf):
-                if deconf:
-                    self.remove_dict_list(self.configurations, label, config)
-                else:
-                    self.append_dict_list(self.configurations, label, config)
+            return self.configure_block(label, src_ip, dst_ip, proto, src_port, dst_port, deconf=deconf)
         
         elif split[0] == 'route-f':
             (src_ip, dst_ip, proto, src_port, dst_port, port) = split[1:]
 
-            if self.configure_route_f(label, src_ip, dst_ip, proto, src_port, dst_port, port, deconf=deconf):
-                if deconf:
-                    self.remove_dict_list(self.configurations, label, config)
-                else:
-                    self.append_dict_list(self.configurations, label, config)
+            return self.configure_route_f(label, src_ip, dst_ip, proto, src_port, dst_port, port, deconf=deconf)
         
         elif split[0] == 'disable':
             port = split[1]
 
-            if self.configure_disable(label, port, deconf=deconf):
-                if deconf:
-                    self.remove_dict_list(self.configurations, label, config)
-                else:
-                    self.append_dict_list(self.configurations, label, config)
+            return self.configure_disable(label, port, deconf=deconf)
 
         else:
             self.logger.error(f'Invalid configuration for device {label}: {config}')
 
+            return False
+
     # Configure address on device
     def configure_address(self, label, interface, address, prefix, deconf=False):
         # Install flow to send ARP requests for the configured address to the controller
@@ -161,13 +319,20 @@ class SdnTopologyDiscovery(app_manager.RyuApp):
 
         actions = [ofp_parser.OFPActionOutput(ofp.OFPP_CONTROLLER)]
         match = ofp_parser.OFPMatch(eth_type=0x0806, in_port=int(interface), arp_tpa=address, arp_op=1)
+
+        # Or answer them in the switch. Removal matches the flow either way
+        hw_addr = next((p['hw_addr'] for p in self.ports[label] if p['port_no'] == int(interface)), None)
+
+        if ARP_RESPONDER and datapath.id in self.nicira and hw_addr is not None:
+            actions = self.arp_responder_actions(ofp, ofp_parser, address, hw_addr)
+
         instructions = [ofp_parser.OFPInstructionActions(ofp.OFPIT_APPLY_ACTIONS, actions)]
         
         if deconf:
-            datapath.send_msg(ofp_parser.OFPFlowMod(datapath=datapath, match=match, instructions=instructions, 
-                                                    command=ofp.OFPFC_DELETE_STRICT, out_port=ofp.OFPP_ANY, out_group=ofp.OFPG_ANY))
+            self.send(datapath, ofp_parser.OFPFlowMod(datapath=datapath, match=match, instructions=instructions, 
+                                                      command=ofp.OFPFC_DELETE_STRICT, out_port=ofp.OFPP_ANY, out_group=ofp.OFPG_ANY))
         else:
-            datapath.send_msg(ofp_parser.OFPFlowMod(datapath=datapath, match=match, instructions=instructions))
+            self.send(datapath, ofp_parser.OFPFlowMod(datapath=datapath, match=match, instructions=instructions))
         
         # Configure route to the configured address
         destination = self.get_network_address(address, prefix)
@@ -176,6 +341,19 @@ class SdnTopologyDiscovery(app_manager.RyuApp):
         self.logger.debug(f'Configured ({not deconf}) address {address} on {interface} for {label}')
         return True
 
+    # Actions turning an ARP request for address into the reply from hw_addr, sent back out of the in port.
+    # Same reply as craft_arp_reply, fields of the request are moved with Nicira register moves
+    def arp_responder_actions(self, ofp, ofp_parser, address, hw_addr):
+        return [
+            ofp_parser.NXActionRegMove(src_field='eth_src', dst_field='eth_dst', n_bits=48),
+            ofp_parser.OFPActionSetField(eth_src=hw_addr),
+            ofp_parser.OFPActionSetField(arp_op=2),
+            ofp_parser.NXActionRegMove(src_field='arp_sha', dst_field='arp_tha', n_bits=48),
+            ofp_parser.NXActionRegMove(src_field='arp_spa', dst_field='arp_tpa', n_bits=32),
+            ofp_parser.OFPActionSetField(arp_sha=hw_addr),
+            ofp_parser.OFPActionSetField(arp_spa=address),
+            ofp_parser.OFPActionOutput(ofp.OFPP_IN_PORT)]
+
     # Configure route on device
     def configure_route(self, label, destination, prefix, interface, deconf=False):
         # Install flow to route packets to the configured destination to the configured interface
@@ -190,10 +368,10 @@ class SdnTopologyDiscovery(app_manager.RyuApp):
         instructions = [ofp_parser.OFPInstructionActions(ofp.OFPIT_APPLY_ACTIONS, actions)]
         
         if deconf:
-            datapath.send_msg(ofp_parser.OFPFlowMod(datapath=datapath, match=match, instructions=instructions, 
-                                                    command=ofp.OFPFC_DELETE_STRICT, out_port=ofp.OFPP_ANY, out_group=ofp.OFPG_ANY))
+            self.send(datapath, ofp_parser.OFPFlowMod(datapath=datapath, match=match, instructions=instructions, 
+                                                      command=ofp.OFPFC_DELETE_STRICT, out_port=ofp.OFPP_ANY, out_group=ofp.OFPG_ANY))
         else:
-            datapath.send_msg(ofp_parser.OFPFlowMod(datapath=datapath, match=match, instructions=instructions))
+            self.send(datapath, ofp_parser.OFPFlowMod(datapath=datapath, match=match, instructions=instructions))
 
         self.logger.debug(f'Configured ({not deconf}) route {destination}/{prefix} to {interface} for {label}')
         return True
@@ -209,10 +387,10 @@ class SdnTopologyDiscovery(app_manager.RyuApp):
         instructions = [ofp_parser.OFPInstructionActions(ofp.OFPIT_APPLY_ACTIONS, [])]
 
         if deconf:
-            datapath.send_msg(ofp_parser.OFPFlowMod(datapath=datapath, match=match, instructions=instructions, 
-                                                    command=ofp.OFPFC_DELETE_STRICT, out_port=ofp.OFPP_ANY, out_group=ofp.OFPG_ANY))
+            self.send(datapath, ofp_parser.OFPFlowMod(datapath=datapath, match=match, instructions=instructions, 
+                                                      command=ofp.OFPFC_DELETE_STRICT, out_port=ofp.OFPP_ANY, out_group=ofp.OFPG_ANY))
         else:
-            datapath.send_msg(ofp_parser.OFPFlowMod(datapath=datapath, match=match, instructions=instructions))
+            self.send(datapath, ofp_parser.OFPFlowMod(datapath=datapath, match=match, instructions=instructions))
         
         self.logger.debug(f'Configured ({not deconf}) block ({src_ip}, {dst_ip}, {proto}, {src_port}, {dst_port}) for {label}')
         return True
@@ -231,10 +409,10 @@ class SdnTopologyDiscovery(app_manager.RyuApp):
         instructions = [ofp_parser.OFPInstructionActions(ofp.OFPIT_APPLY_ACTIONS, actions)]
 
         if deconf:
-            datapath.send_msg(ofp_parser.OFPFlowMod(datapath=datapath, match=match, instructions=instructions, 
-                                                    command=ofp.OFPFC_DELETE_STRICT, out_port=ofp.OFPP_ANY, out_group=ofp.OFPG_ANY))
+            self.send(datapath, ofp_parser.OFPFlowMod(datapath=datapath, match=match, instructions=instructions, 
+                                                      command=ofp.OFPFC_DELETE_STRICT, out_port=ofp.OFPP_ANY, out_group=ofp.OFPG_ANY))
         else:
-            datapath.send_msg(ofp_parser.OFPFlowMod(datapath=datapath, match=match, instructions=instructions))
+            self.send(datapath, ofp_parser.OFPFlowMod(datapath=datapath, match=match, instructions=instructions))
         
         self.logger.debug(f'Configured ({not deconf}) route-f ({src_ip}, {dst_ip}, {proto}, {src_port}, {dst_port}) to {port} for {label}')
         return True
@@ -257,7 +435,7 @@ class SdnTopologyDiscovery(app_manager.RyuApp):
 
         port_mod = ofp_parser.OFPPortMod(datapath=datapath, port_no=int(port), hw_addr=hw_addr, config=config, mask=mask)
 
-        datapath.send_msg(port_mod)
+        self.send(datapath, port_mod)
 
         if not deconf:
             # Clear neighbor entries of the disabled port
@@ -313,25 +491,24 @@ class SdnTopologyDiscovery(app_manager.RyuApp):
         
         return match
 
-    # Load SDN devices labels from previous sessions
+    # Import SDN devices labels of previous sessions from config/sdn.txt into a new inventory
     def load_all_labels(self):
-        labels = {}
-        count = 0
-
-        try:
-            with open('config/sdn.txt', 'r') as file:
-                lines = file.read().splitlines()
-                for line in lines:
-                    split = line.split(':')
-                    labels[int(split[0])] = split[1]
-                count = len(lines)
-        except FileNotFoundError:
-            self.logger.debug('config/sdn.txt does not exist.')
-        except:
-            self.logger.error('Error loading from config/sdn.txt')
+        if self.inventory.new:
+            records = []
+
+            try:
+                with open('config/sdn.txt', 'r') as file:
+                    for line in file.read().splitlines():
+                        split = line.split(':')
+                        records.append({'name': split[1], 'dpid': int(split[0])})
+            except FileNotFoundError:
+                self.logger.debug('config/sdn.txt does not exist.')
+            except:
+                self.logger.error('Error loading from config/sdn.txt')
+
+            self.inventory.add_all(records)
         
-        self.all_labels = labels
-        self.labels_count = count
+        self.labels_count = len(self.inventory)
 
     # Listener for new switch connections. Add them to topology, and start LLDP discovery
     # Also used for removing disconnected switches from topology
@@ -344,8 +521,10 @@ class SdnTopologyDiscovery(app_manager.RyuApp):
         # TODO: What happens when SDN device label is changed while the network is running (using GUI)?
         #       What become of the old LLDP relationships? And how will that affect the flow of the program?
         if ev.state == MAIN_DISPATCHER:
-            if datapath.id in self.all_labels:
-                label = self.all_labels[datapath.id]
+            record = self.inventory.by_dpid(datapath.id)
+
+            if record is not None:
+                label = record['name']
 
                 self.labels[datapath.id] = label
                 self.datapaths[label] = datapath
@@ -356,17 +535,16 @@ class SdnTopologyDiscovery(app_manager.RyuApp):
                 self.labels_count += 1
 
                 self.labels[datapath.id] = label
-                self.all_labels[datapath.id] = label
+                self.inventory.add(label, dpid=datapath.id) # Written in the background, not in this handler
 
                 self.logger.debug(f'Found new SDN device: {datapath.id} ({label})')
 
-                try:
-                    with open('config/sdn.txt', 'a') as file:
-                        file.write(f'{datapath.id}:{label}\n')
-                except:
-                    self.logger.error(f'Error writing {label} to config/sdn.txt')
-
             self.ports[label] = []
+            self.lldp_frames[label] = {}
+
+            # Request switch description, to detect Nicira extensions for ARP responder flows
+            if ARP_RESPONDER:
+                datapath.send_msg(ofp_parser.OFPDescStatsRequest(datapath, 0))
 
             # Request switch ports, and start LLDP discovery on reply
             req = ofp_parser.OFPPortDescStatsRequest(datapath, 0)
@@ -380,8 +558,16 @@ class SdnTopologyDiscovery(app_manager.RyuApp):
 
             self.logger.debug(f'Datapath {datapath.id} connected, label: {self.labels[datapath.id]}')
         else:
+            self.drop_push(datapath.id)
+            self.nicira.discard(datapath.id)
+
+            # Ports still on the timer wheel are skipped when due, see send_lldp
+            for key in [key for key in self.lldp_fast if key[0] == datapath.id]:
+                self.lldp_fast.pop(key)
+
             self.ports.pop(self.labels[datapath.id])
             self.lldp.pop(self.labels[datapath.id])
+            self.lldp_frames.pop(self.labels[datapath.id], None)
 
             self.datapaths.pop(self.labels[datapath.id])
             self.labels.pop(datapath.id)
@@ -389,6 +575,20 @@ class SdnTopologyDiscovery(app_manager.RyuApp):
             self.logger.debug(f'Datapath {datapath.id} disconnected')
 
 
+    # Listener for switch description, Open vSwitch supports the Nicira extensions used by ARP responder flows.
+    # Addresses configured before the reply use the controller ARP responder (packet-in)
+    @set_ev_cls(ofp_event.EventOFPDescStatsReply, MAIN_DISPATCHER)
+    def desc_reply_handler(self, ev):
+        datapath = ev.msg.datapath
+        body = ev.msg.body
+
+        description = [field.decode(errors='ignore') if isinstance(field, bytes) else field for field in (body.mfr_desc, body.hw_desc)]
+
+        if 'Nicira' in description[0] or 'Open vSwitch' in description[1]:
+            self.nicira.add(datapath.id)
+
+        self.logger.debug(f'Datapath {datapath.id} ({self.labels[datapath.id]}) description: {description}, Nicira extensions: {datapath.id in self.nicira}')
+
     # Listener for port description requests, starts LLDP discovery
     @set_ev_cls(ofp_event.EventOFPPortDescStatsReply, MAIN_DISPATCHER)
     def port_desc_reply_handler(self, ev):
@@ -409,48 +609,58 @@ class SdnTopologyDiscovery(app_manager.RyuApp):
         self.ports[self.labels[datapath.id]] = ports
         self.lldp[self.labels[datapath.id]] = {}
 
-        # Start LLDP discovery
-        self.start_lldp(datapath, timeout=1)
+        self.build_lldp_frames(self.labels[datapath.id])
+
+        # Start LLDP discovery, new ports are probed fast
+        for port in ports:
+            self.probe_fast(datapath.id, port['port_no'])
 
         self.logger.debug(f'Datapath {datapath.id} ({self.labels[datapath.id]}) ports: {ports}')
 
-    # Start LLDP for a switch
-    # The purpose of this function is to periodically send LLDP packets out of all ports of a switch,
-    # it works by installing a dummy flow with a hard timeout, which will trigger a flow removed event,
-    # then the flow removed event handler will send the LLDP packets, and will call this function again,
-    # thus creating an infinite loop with constant intervals.
-    # This function is also used to update LLDP timers, and send topology to TopologyManager, since it's already running periodically
-    def start_lldp(self, datapath, timeout=15):
-        ofp = datapath.ofproto
-        ofp_parser = datapath.ofproto_parser
+    # Send LLDP packets of ports as they become due on the timer wheel, and update LLDP database every second.
+    # Each port has its own jittered schedule, so LLDP packets are spread over the interval instead of sent for all ports at once
+    def run_lldp(self):
+        start = time.time()
 
-        instructions = [ofp_parser.OFPInstructionActions(ofp.OFPIT_APPLY_ACTIONS, [])]
-        datapath.send_msg(ofp_parser.OFPFlowMod(datapath=datapath, priority=10, hard_timeout=timeout, instructions=instructions, flags=ofp.OFPFF_SEND_FLOW_REM))
+        while True:
+            hub.sleep(LLDP_TICK)
 
-        self.update_lldp_database()
+            # Catch up with ticks missed while other threads were running
+            while self.lldp_wheel.current < int((time.time() - start) / LLDP_TICK):
+                for (dpid, port_no) in self.lldp_wheel.advance():
+                    self.send_lldp(dpid, port_no)
 
-        self.logger.debug(f'Starting LLDP on {self.labels[datapath.id]} ({self.labels[datapath.id]}). Timeout: {timeout}')
+            self.update_lldp_database()
 
-    # Flow removed event handler, used for sending periodic LLDP packets
-    @set_ev_cls(ofp_event.EventOFPFlowRemoved, MAIN_DISPATCHER)
-    def flow_removed_send_lldp(self, ev):
-        msg = ev.msg
-        reason = msg.reason
-        datapath = msg.datapath
+    # Send LLDP packet out of port, and schedule the next one
+    def send_lldp(self, dpid, port_no):
+        label = self.labels.get(dpid)
+        frame = self.lldp_frames.get(label, {}).get(port_no)
+
+        # Switch disconnected or port removed
+        if frame is None:
+            return
+
+        datapath = self.datapaths[label]
         ofp = datapath.ofproto
         ofp_parser = datapath.ofproto_parser
 
-        if reason == ofp.OFPRR_HARD_TIMEOUT:
-            for p in self.ports[self.labels[datapath.id]]:
-                pkt = self.craft_lldp(self.labels[datapath.id], p)
-                actions = [ofp_parser.OFPActionOutput(p['port_no'])]
-                packet_out = ofp_parser.OFPPacketOut(datapath=datapath, buffer_id=ofp.OFP_NO_BUFFER, in_port=ofp.OFPP_CONTROLLER, actions=actions, data=pkt.build())
-                
-                datapath.send_msg(packet_out)
+        actions = [ofp_parser.OFPActionOutput(port_no)]
+        datapath.send_msg(ofp_parser.OFPPacketOut(datapath=datapath, buffer_id=ofp.OFP_NO_BUFFER, in_port=ofp.OFPP_CONTROLLER, actions=actions, data=frame))
 
-            self.start_lldp(datapath)
-        
-        self.logger.debug(f'OFPFlowRemoved received ({reason})')
+        fast = self.lldp_fast.pop((dpid, port_no), 0)
+
+        if fast > 1:
+            self.lldp_fast[(dpid, port_no)] = fast - 1
+
+        interval = LLDP_FAST_INTERVAL if fast > 1 else LLDP_INTERVAL
+        self.lldp_wheel.schedule((dpid, port_no), interval * random.uniform(1 - LLDP_JITTER, 1 + LLDP_JITTER))
+
+    # Probe port LLDP_FAST_PROBES times at LLDP_FAST_INTERVAL, used for new ports and changed neighbors.
+    # The first LLDP packet is sent within LLDP_FAST_INTERVAL
+    def probe_fast(self, dpid, port_no):
+        self.lldp_fast[(dpid, port_no)] = LLDP_FAST_PROBES
+        self.lldp_wheel.schedule((dpid, port_no), random.uniform(0, LLDP_FAST_INTERVAL))
 
     # Listener for incoming packets
     @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
@@ -461,24 +671,40 @@ class SdnTopologyDiscovery(app_manager.RyuApp):
         ofp_parser = datapath.ofproto_parser
         port_in = msg.match['in_port']
 
-        pkt = Ether(msg.data)
+        # Fields are read from the raw frame (see src/topology/packets.py), this handler runs for every LLDP and ARP packet
+        data = msg.data
+        eth_type = packets.ethertype(data)
+
+        if eth_type == packets.ETH_TYPE_LLDP:
+            (system_name, time_to_live) = packets.parse_lldp(data)
+
+            if system_name is None or time_to_live is None:
+                self.logger.debug(f'LLDP packet without system name or TTL received on {self.labels[datapath.id]}, port: {port_in}')
+                return
+
+            neighbor = self.lldp[self.labels[datapath.id]].get(system_name)
 
-        if pkt.type == 0x88cc: # LLDP EtherType
-            system_name = pkt[lldp.LLDPDUSystemName].system_name.decode()
-            time_to_live = pkt[lldp.LLDPDUTimeToLive].ttl
+            # New neighbor, or neighbor moved to another port. Probe fast, so the neighbor learns about this switch quickly too
+            if neighbor is None or neighbor['port'] != port_in:
+                self.probe_fast(datapath.id, port_in)
 
             self.lldp[self.labels[datapath.id]][system_name] = {'port': port_in, 'ttl': time_to_live}
 
             self.logger.debug(f'LLDP packet received on {self.labels[datapath.id]} ({self.labels[datapath.id]}), port: {port_in}, system name: {system_name} TTL: {time_to_live}')
 
-        elif pkt.type == 0x0806: # ARP EtherType
-            arp_reply = self.craft_arp_reply(self.labels[datapath.id], port_in, pkt)
-            datapath.send_msg(datapath.ofproto_parser.OFPPacketOut(datapath=datapath, buffer_id=datapath.ofproto.OFP_NO_BUFFER, in_port=ofp.OFPP_CONTROLLER, actions=[datapath.ofproto_parser.OFPActionOutput(port_in)], data=arp_reply.build()))
+        elif eth_type == packets.ETH_TYPE_ARP:
+            arp_reply = self.craft_arp_reply(self.labels[datapath.id], port_in, data)
 
-            self.logger.debug(f'ARP packet received on {datapath.id} ({self.labels[datapath.id]}), port: {port_in}, packet: {pkt}')
+            if arp_reply is None:
+                self.logger.debug(f'Invalid ARP packet received on {datapath.id} ({self.labels[datapath.id]}), port: {port_in}')
+                return
+
+            datapath.send_msg(datapath.ofproto_parser.OFPPacketOut(datapath=datapath, buffer_id=datapath.ofproto.OFP_NO_BUFFER, in_port=ofp.OFPP_CONTROLLER, actions=[datapath.ofproto_parser.OFPActionOutput(port_in)], data=arp_reply))
+
+            self.logger.debug(f'ARP packet received on {datapath.id} ({self.labels[datapath.id]}), port: {port_in}')
 
         else:
-            self.logger.debug(f'Packet in received on {datapath.id} ({self.labels[datapath.id]}), port: {port_in}, packet: {pkt}')
+            self.logger.debug(f'Packet in received on {datapath.id} ({self.labels[datapath.id]}), port: {port_in}, EtherType: {eth_type}')
         
     # Update LLDP timers, remove expired entries, and send topology to TopologyManager
     def update_lldp_database(self):
@@ -495,7 +721,10 @@ class SdnTopologyDiscovery(app_manager.RyuApp):
                 neighbors[system_name]['ttl'] -= passed_time
 
                 if neighbors[system_name]['ttl'] <= 0:
-                    neighbors.pop(system_name)
+                    port_no = neighbors.pop(system_name)['port']
+
+                    # Neighbor lost, probe its port fast to find what replaced it
+                    self.probe_fast(self.datapaths[label].id, port_no)
 
                     self.logger.debug(f'LLDP entry expired, label: {label}, system name: {system_name}')
         
@@ -508,6 +737,10 @@ class SdnTopologyDiscovery(app_manager.RyuApp):
         topology = {'ports': self.ports, 'neighbors': self.lldp}
         self.send_event_to_observers(EventSdnTopology(topology))
 
+    # Build LLDP frames of every port of switch, sent by send_lldp
+    def build_lldp_frames(self, label):
+        self.lldp_frames[label] = {p['port_no']: self.craft_lldp(label, p).build() for p in self.ports[label]}
+
     # Craft LLDP packet
     def craft_lldp(self, label, port):
         port_no = port['port_no']
@@ -521,22 +754,15 @@ class SdnTopologyDiscovery(app_manager.RyuApp):
         / lldp.LLDPDUPortDescription(description=f'OFPort-{port_no}') \
         / lldp.LLDPDUEndOfLLDPDU()
 
-    # Carft ARP reply packet
-    def craft_arp_reply(self, label, port_in, pkt):
+    # Carft ARP reply frame to ARP request frame, from the MAC address of the port it was received on.
+    # None if the request is truncated or the port is unknown
+    def craft_arp_reply(self, label, port_in, request):
         hw_addr = next((p['hw_addr'] for p in self.ports[label] if p['port_no'] == port_in), None)
 
-        return Ether(dst=pkt[Ether].src, src=hw_addr) \
-        / ARP(op=2, hwsrc=hw_addr, psrc=pkt[ARP].pdst, hwdst=pkt[ARP].hwsrc, pdst=pkt[ARP].psrc)
+        if hw_addr is None or packets.parse_arp(request) is None:
+            return None
 
-    def append_dict_list(self, dict, key, item):
-        if key in dict:
-            dict[key].append(item)
-        else:
-            dict[key] = [item]
-    
-    def remove_dict_list(self, dict, key, item):
-        if key in dict:
-            dict[key].remove(item)
+        return packets.arp_reply(packets.mac_to_bytes(hw_addr), request)
 
     def get_network_address(self, address, prefix):
         address = address.split('.')